@@ -0,0 +1,199 @@
+# === Offline pipeline benchmark ===
+# Generates synthetic posts_unlabeled rows into a local posts source (POSTS_SOURCE=sqlite or
+# jsonl, per BENCH_SOURCE) and runs every stage of summary.py against a local libsql file with
+# small randomly initialised models, so throughput regressions in fetching, labeling, topic
+# modeling, inserts, snapshot aggregation or export show up without Supabase or Turso
+# credentials. Everything lives in BENCH_DIR and is recreated per run.
+#
+#   BENCH_POSTS=100000 python scripts/benchmark.py
+#
+# Any summary.py setting (LABEL_WORKERS, SNAPSHOT_BACKEND, EXPORT_COMPRESS, ...) can be set
+# alongside to compare configurations. The per-stage report is printed and written to
+# BENCH_DIR/benchmark_run.json.
+import os
+import random
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCH_POSTS = int(os.getenv("BENCH_POSTS", "10000"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "0"))
+BENCH_DIR = os.path.abspath(os.getenv("BENCH_DIR", "bench"))
+BENCH_SOURCE = os.getenv("BENCH_SOURCE", "sqlite")  # sqlite or jsonl
+BENCH_DUPLICATES = float(os.getenv("BENCH_DUPLICATES", "0.05"))  # share of reposted texts
+BENCH_VOCAB_SIZE = int(os.getenv("BENCH_VOCAB_SIZE", "2000"))
+BENCH_MODEL_HIDDEN = int(os.getenv("BENCH_MODEL_HIDDEN", "64"))
+BENCH_MODEL_LAYERS = int(os.getenv("BENCH_MODEL_LAYERS", "2"))
+
+SENTIMENT_LABELS = ["label_0", "label_1", "label_2"]
+EMOTION_LABELS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+
+BASE_WORDS = [
+    "feeling", "anxious", "today", "therapy", "helps", "hope", "sad", "tired", "friends",
+    "support", "sleep", "work", "stress", "panic", "better", "healing", "lonely", "family",
+    "depression", "anxiety", "recovery", "talk", "mind", "health", "mental", "week", "love",
+    "struggling", "grateful", "burnout", "meds", "doctor", "night", "morning", "alone", "okay",
+]
+HASHTAGS = [f"#{w}" for w in ("MentalHealth", "Anxiety", "Depression", "SelfCare", "Healing", "YouMatter", "Therapy", "Burnout")]
+HASHTAGS += [f"#topic{i}" for i in range(300)]
+EMOJIS = ["😊", "🙏", "💔", "😢", "🙂", "😭", "❤️", "😔", "🥺", "✨", "😂", "💪", "🌱", "😞", "🤗", "😩", "💙", "🫂", "😤", "🌈"]
+LANGS = [(["en"], 80), (["es"], 8), (["en", "es"], 5), (["pt"], 4), ([], 3)]
+
+# === Synthetic Data ===
+def zipf_weights(n):
+    # Cumulative 1/rank weights, so a few words, tags and emojis dominate like in real posts.
+    total = 0.0
+    cumulative = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank
+        cumulative.append(total)
+    return cumulative
+
+VOCAB = BASE_WORDS + [f"term{i}" for i in range(max(0, BENCH_VOCAB_SIZE - len(BASE_WORDS)))]
+VOCAB_WEIGHTS = zipf_weights(len(VOCAB))
+HASHTAG_WEIGHTS = zipf_weights(len(HASHTAGS))
+EMOJI_WEIGHTS = zipf_weights(len(EMOJIS))
+
+def synthetic_text(rnd):
+    # Log-normal word counts: mostly short posts (some under the 30-character labeling cutoff)
+    # with a long tail up to the 300-character limit.
+    n_words = max(1, min(80, int(rnd.lognormvariate(2.3, 0.8))))
+    words = rnd.choices(VOCAB, cum_weights=VOCAB_WEIGHTS, k=n_words)
+    # Roughly one post in a hundred is hashtag spam that exceeds GRAPH_MAX_TAGS_PER_POST.
+    n_tags = rnd.choice((0, 0, 1, 1, 2, 3)) if rnd.random() > 0.01 else rnd.randint(20, 40)
+    words += rnd.choices(HASHTAGS, cum_weights=HASHTAG_WEIGHTS, k=n_tags)
+    words += rnd.choices(EMOJIS, cum_weights=EMOJI_WEIGHTS, k=rnd.choice((0, 0, 1, 2, 3)))
+    if rnd.random() < 0.1:
+        words.append(f"https://example.com/{rnd.randint(0, 10 ** 6)}")
+    if rnd.random() < 0.1:
+        words.insert(0, f"@user{rnd.randint(0, 5000)}.bsky.social")
+    return " ".join(words)
+
+def synthetic_posts(start_dt, end_dt, n=BENCH_POSTS, seed=BENCH_SEED):
+    # Yields posts in (created_at, uri) order spread evenly over [start_dt, end_dt), the same
+    # order the ingestion keyset pages in, without holding the whole set in memory.
+    rnd = random.Random(seed)
+    langs, lang_weights = zip(*LANGS)
+    recent = []
+    step = (end_dt - start_dt) / max(n, 1)
+    for i in range(n):
+        created_at = start_dt + step * i
+        if recent and rnd.random() < BENCH_DUPLICATES:
+            text = rnd.choice(recent)
+        else:
+            text = synthetic_text(rnd)
+            recent.append(text)
+            if len(recent) > 1000:
+                recent.pop(0)
+        did = f"did:plc:bench{rnd.randint(0, max(1, n // 5)):07d}"
+        yield {
+            "uri": f"at://{did}/app.bsky.feed.post/{i:08d}",
+            "did": did,
+            "text": text,
+            "created_at": created_at.isoformat(timespec="milliseconds") + "Z",
+            "langs": rnd.choices(langs, weights=lang_weights)[0],
+            "facets": None,
+            "reply": None,
+            "embed": None,
+            "ingestion_time": (created_at + timedelta(seconds=rnd.randint(1, 120))).isoformat(timespec="milliseconds") + "Z",
+        }
+
+# === Stub Models ===
+def stub_tokenizer():
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3}
+    for word in VOCAB:
+        vocab.setdefault(word, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    backend.post_processor = processors.TemplateProcessing(single="<s> $A </s>", special_tokens=[("<s>", 0), ("</s>", 2)])
+    return PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", pad_token="<pad>", unk_token="<unk>",
+        model_max_length=512
+    )
+
+def stub_model(num_labels, vocab_size, seed):
+    # Same architecture family as the production heads, just small and randomly initialised.
+    import torch
+    from transformers import RobertaConfig, RobertaForSequenceClassification
+
+    torch.manual_seed(seed)
+    config = RobertaConfig(
+        vocab_size=vocab_size, hidden_size=BENCH_MODEL_HIDDEN, num_hidden_layers=BENCH_MODEL_LAYERS,
+        num_attention_heads=2, intermediate_size=BENCH_MODEL_HIDDEN * 4, max_position_embeddings=summary.LABEL_MAX_LENGTH + 4,
+        num_labels=num_labels, pad_token_id=1
+    )
+    return RobertaForSequenceClassification(config).eval()
+
+def load_stub_models():
+    DEVICE = "cpu"
+    tokenizer = stub_tokenizer()
+    sent_model = stub_model(len(SENTIMENT_LABELS), len(tokenizer), seed=BENCH_SEED)
+    emot_model = stub_model(len(EMOTION_LABELS), len(tokenizer), seed=BENCH_SEED + 1)
+    # Goes through the same backend selection as load_models(), so LABEL_BACKEND=onnx works too.
+    sent_model = summary.select_backend("sentiment", sent_model, tokenizer, SENTIMENT_LABELS, os.path.join(BENCH_DIR, "models", "sentiment"), DEVICE)
+    emot_model = summary.select_backend("emotion", emot_model, tokenizer, EMOTION_LABELS, os.path.join(BENCH_DIR, "models", "emotion"), DEVICE)
+    return tokenizer, sent_model, SENTIMENT_LABELS, tokenizer, emot_model, EMOTION_LABELS, DEVICE
+
+# === Local Source ===
+def write_source(source):
+    # Fills the local posts source with six full days up to today's midnight (UTC), inside
+    # both the ingestion window and the snapshot window, so a given seed yields the same
+    # posts all day long.
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=6)
+    posts = synthetic_posts(start, end)
+    while True:
+        batch = [post for post in [next(posts, None) for _ in range(10000)] if post]
+        if not batch:
+            return
+        source.add_posts(batch)
+
+# === Run ===
+shutil.rmtree(BENCH_DIR, ignore_errors=True)
+os.makedirs(BENCH_DIR)
+os.chdir(BENCH_DIR)
+
+# summary.py reads its settings at import time; point it at local files only.
+os.environ["TURSO_DB_URL"] = os.path.join(BENCH_DIR, "bench.db")
+os.environ.pop("TURSO_DB_TOKEN", None)
+os.environ["TEST_MODE"] = "0"
+os.environ["POSTS_SOURCE"] = BENCH_SOURCE
+os.environ["POSTS_SOURCE_PATH"] = os.path.join(BENCH_DIR, f"posts_unlabeled.{BENCH_SOURCE}")
+os.environ.setdefault("LABEL_CACHE_PATH", os.path.join(BENCH_DIR, "label_cache.db"))
+os.environ.setdefault("RUN_REPORT_PATH", os.path.join(BENCH_DIR, "benchmark_run.json"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import summary  # noqa: E402
+
+print(f"🏁 Benchmarking {BENCH_POSTS} synthetic posts in {BENCH_DIR} (seed {BENCH_SEED})...")
+summary.connect_source()
+with summary.timed("generate"):
+    write_source(summary.posts_source)
+summary.connect_db()
+# The database starts empty, so the one-time rollup and tag backfills have nothing to do;
+# skip them like on an established database, where migrate_labeled keeps both current.
+summary.save_state("rollups_ready", True)
+summary.save_state("tags_ready", True)
+with summary.timed("load_models"):
+    models = load_stub_models()
+
+# Data generation and model setup are reported as its own stage but kept out of the end-to-end posts/s.
+started_at = datetime.utcnow().isoformat() + "Z"
+started = time.perf_counter()
+summary.hardened_label_and_migrate(*models)
+with summary.timed("export"):
+    summary.export_snapshots_to_json()
+
+elapsed = time.perf_counter() - started
+report = summary.run_report("benchmark", started_at, elapsed)
+report["posts"] = BENCH_POSTS
+report["posts_per_sec"] = round(BENCH_POSTS / elapsed, 2) if elapsed else None
+report["settings"] = {key: value for key, value in sorted(os.environ.items()) if key.split("_")[0] in (
+    "BENCH", "POSTS", "LABEL", "TOPIC", "SNAPSHOT", "GRAPH", "EXPORT", "PIPELINE", "FETCH"
+) and not key.endswith("_PATH")}
+summary.write_run_report(report)
+print(f"🏁 {BENCH_POSTS} posts end to end in {elapsed:.1f}s ({report['posts_per_sec']} posts/s), peak RSS {report['peak_rss_mb']} MB.")
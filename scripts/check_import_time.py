@@ -0,0 +1,50 @@
+# === Import-time budget for EXPORT_ONLY startup ===
+# Runs `python -X importtime` on what an export-only run imports before it touches the
+# database (summary.py itself plus the libsql driver) and fails when the cumulative time
+# exceeds IMPORT_BUDGET_MS or when a labeling-only dependency gets pulled in.
+import os
+import subprocess
+import sys
+
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+FORBIDDEN = ("sklearn", "torch", "transformers", "supabase", "onnxruntime")
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+code = (
+    f"import sys; sys.path.insert(0, {SCRIPTS_DIR!r}); "
+    "import summary, libsql_experimental; "
+    "print(' '.join(sorted(sys.modules)))"
+)
+result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+if result.returncode != 0:
+    print(result.stderr)
+    print("❌ Importing summary.py failed.")
+    sys.exit(1)
+
+# Lines look like "import time: self [us] | cumulative | name"; nested imports are indented,
+# so the top-level entries add up to the total.
+total_us = 0
+slowest = []
+for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "[us]" in line:
+        continue
+    _, cumulative, name = line.split("|")
+    if name.startswith("  "):
+        continue
+    total_us += int(cumulative)
+    slowest.append((int(cumulative), name.strip()))
+
+loaded = set(result.stdout.split())
+pulled_in = [m for m in FORBIDDEN if m in loaded]
+
+print(f"⏱️ EXPORT_ONLY import time: {total_us / 1000:.1f} ms (budget {BUDGET_MS:.0f} ms)")
+for us, name in sorted(slowest, reverse=True)[:5]:
+    print(f"   {us / 1000:8.1f} ms  {name}")
+
+if pulled_in:
+    print(f"❌ Export-only startup imports labeling dependencies: {', '.join(pulled_in)}")
+    sys.exit(1)
+if total_us / 1000 > BUDGET_MS:
+    print("❌ Import time budget exceeded.")
+    sys.exit(1)
+print("✅ Import time within budget.")
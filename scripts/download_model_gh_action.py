@@ -4,9 +4,10 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification
 def ensure_model_downloaded(model_id: str, save_path: str):
     save_path = os.path.expanduser(save_path)
     config_path = os.path.join(save_path, "config.json")
-    model_path = os.path.join(save_path, "pytorch_model.bin")
+    # Newer transformers versions save model.safetensors instead of pytorch_model.bin.
+    model_paths = [os.path.join(save_path, name) for name in ("model.safetensors", "pytorch_model.bin")]
 
-    if not os.path.exists(config_path) or not os.path.exists(model_path):
+    if not os.path.exists(config_path) or not any(os.path.exists(path) for path in model_paths):
         print(f"⬇️ Downloading model: {model_id} to {save_path}")
         try:
             tokenizer = AutoTokenizer.from_pretrained(model_id)
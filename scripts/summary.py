@@ -1,17 +1,19 @@
 # === CognitiveSky Full Pipeline: Part 1 ===
-print("✅ summary.py is running...")
-
+# Heavy dependencies (libsql, supabase, sklearn, torch/transformers, dateutil) are imported
+# inside the functions that use them, so each mode only pays for what it needs.
 import os
 import json
+import queue
+import threading
+import time
 import hashlib
-from datetime import datetime, timedelta, date
+import shutil
+from datetime import datetime, timedelta, date, timezone
 import re
 from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import islice
 from dotenv import load_dotenv
-from supabase import create_client
-import libsql_experimental as libsql
-from sklearn.feature_extraction.text import TfidfVectorizer
-from dateutil.parser import isoparse
 
 # === Constants ===
 today = date.today().isoformat()
@@ -26,95 +28,354 @@ TURSO_DB_URL = os.getenv("TURSO_DB_URL")
 TURSO_DB_TOKEN = os.getenv("TURSO_DB_TOKEN")
 IS_TEST = os.getenv("TEST_MODE") == "1"
 
-# Validate required environment variables
-if not SUPABASE_URL or not SUPABASE_KEY or not TURSO_DB_URL or not TURSO_DB_TOKEN:
-    print("❌ Missing required environment variables. Please set SUPABASE_URL, SUPABASE_KEY, TURSO_DB_URL, and TURSO_DB_TOKEN.")
-    exit(1)
-
 # === Clients ===
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = None
+conn = None
+prod_conn = None
+posts_source = None
+
+def connect_supabase():
+    # Only a labeling run reading from the Supabase source talks to Supabase.
+    global supabase
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Missing required environment variables. Please set SUPABASE_URL and SUPABASE_KEY.")
+        exit(1)
+    from supabase import create_client
 
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # === DB Connection ===
-if IS_TEST:
-    conn = libsql.connect("test_turso_local.db")
-    prod_conn = libsql.connect(TURSO_DB_URL, auth_token=TURSO_DB_TOKEN)
+def is_remote_db(url):
+    return url.split("://", 1)[0] in ("libsql", "http", "https", "ws", "wss")
+
+def open_db():
+    # The working database behind `conn`; snapshot workers open their own connection with it.
+    import libsql_experimental as libsql
+
+    if IS_TEST:
+        return libsql.connect("test_turso_local.db")
+    return libsql.connect(TURSO_DB_URL, auth_token=TURSO_DB_TOKEN or "")
+
+def connect_db():
+    global conn, prod_conn
+    # A local file path (e.g. for offline profiling) needs no auth token.
+    if not TURSO_DB_URL or (is_remote_db(TURSO_DB_URL) and not TURSO_DB_TOKEN):
+        print("❌ Missing required environment variables. Please set TURSO_DB_URL and TURSO_DB_TOKEN.")
+        exit(1)
+    import libsql_experimental as libsql
+
+    conn = open_db()
+    if IS_TEST:
+        prod_conn = libsql.connect(TURSO_DB_URL, auth_token=TURSO_DB_TOKEN or "")
+
+        try:
+            prod_conn.execute("SELECT 1")
+            print("✅ Production database connection successful.")
+        except Exception as e:
+            print(f"❌ Production database connection failed: {e}")
+            exit(1)
 
     try:
-        prod_conn.execute("SELECT 1")
-        print("✅ Production database connection successful.")
+        conn.execute("SELECT 1")
+        print("✅ Database connection successful.")
     except Exception as e:
-        print(f"❌ Production database connection failed: {e}")
+        print(f"❌ Database connection failed: {e}")
         exit(1)
 
-else:
-    conn = libsql.connect(TURSO_DB_URL, auth_token=TURSO_DB_TOKEN)
-try:
-    conn.execute("SELECT 1")
-    print("✅ Database connection successful.")
-except Exception as e:
-    print(f"❌ Database connection failed: {e}")
-    exit(1)
+    create_tables()
+    if IS_TEST:
+        sync_test_db()
+
+    # Backfill `day` for rows stored before the column existed (or synced without it).
+    conn.execute("UPDATE posts SET day = date(created_at) WHERE day IS NULL AND created_at IS NOT NULL")
+    conn.commit()
 
 # === Create Tables ===
-conn.execute("""CREATE TABLE IF NOT EXISTS posts (
-    uri TEXT PRIMARY KEY,
-    did TEXT,
-    text TEXT,
-    created_at TEXT,
-    langs TEXT,
-    facets TEXT,
-    reply TEXT,
-    embed TEXT,
-    ingestion_time TEXT,
-    sentiment TEXT,
-    emotion TEXT,
-    topic TEXT
-)""")
-
-conn.execute("""CREATE TABLE IF NOT EXISTS summary_snapshots (
-    date TEXT,
-    type TEXT,
-    scope TEXT,
-    hash TEXT,
-    data TEXT,
-    PRIMARY KEY(date, type, scope)
-)""")
+def create_tables():
+    conn.execute("""CREATE TABLE IF NOT EXISTS posts (
+        uri TEXT PRIMARY KEY,
+        did TEXT,
+        text TEXT,
+        created_at TEXT,
+        langs TEXT,
+        facets TEXT,
+        reply TEXT,
+        embed TEXT,
+        ingestion_time TEXT,
+        sentiment TEXT,
+        emotion TEXT,
+        topic TEXT,
+        day TEXT
+    )""")
+
+    # `day` is the indexed UTC calendar day of created_at; older databases gain it here.
+    if "day" not in [c[1] for c in conn.execute("PRAGMA table_info(posts)").fetchall()]:
+        conn.execute("ALTER TABLE posts ADD COLUMN day TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_day ON posts(day)")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS summary_snapshots (
+        date TEXT,
+        type TEXT,
+        scope TEXT,
+        hash TEXT,
+        data TEXT,
+        PRIMARY KEY(date, type, scope)
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_rollup (
+        day TEXT,
+        kind TEXT,
+        key TEXT,
+        count INTEGER,
+        PRIMARY KEY(day, kind, key)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_rollup_kind ON daily_rollup(kind, key, count)")
+
+    # Hashtags and emojis extracted once at insert time, one row per occurrence (pos keeps
+    # the in-text order); snapshots count them with GROUP BY instead of re-scanning text.
+    conn.execute("""CREATE TABLE IF NOT EXISTS post_hashtags (
+        post_uri TEXT,
+        pos INTEGER,
+        tag TEXT,
+        day TEXT,
+        PRIMARY KEY(post_uri, pos)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_post_hashtags_day ON post_hashtags(day, tag)")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS post_emojis (
+        post_uri TEXT,
+        pos INTEGER,
+        emoji TEXT,
+        day TEXT,
+        PRIMARY KEY(post_uri, pos)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_post_emojis_day ON post_emojis(day, emoji)")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_partials (
+        day TEXT,
+        type TEXT,
+        version TEXT,
+        data TEXT,
+        PRIMARY KEY(day, type)
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_runs (
+        started_at TEXT,
+        mode TEXT,
+        seconds REAL,
+        peak_rss_mb REAL,
+        report TEXT
+    )""")
+
+    conn.execute("""CREATE TABLE IF NOT EXISTS topic_model (
+        name TEXT PRIMARY KEY,
+        data TEXT,
+        updated_at TEXT
+    )""")
 
 # === Helper Functions ===
-def compute_hash(obj):
-    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+EMOJI_RE = re.compile(r"["
+    u"\U0001F600-\U0001F64F"
+    u"\U0001F300-\U0001F5FF"
+    u"\U0001F680-\U0001F6FF"
+    u"\u2600-\u26FF"
+    u"\U0001F1E0-\U0001F1FF"
+    "]", flags=re.UNICODE)
+HASHTAG_RE = re.compile(r"#\w+")
+
+def extract_tags(text):
+    return HASHTAG_RE.findall(text or ""), EMOJI_RE.findall(text or "")
+
+def post_day(created_at):
+    # UTC calendar day of a post, matching SQLite's date(created_at).
+    from dateutil.parser import isoparse
+
+    try:
+        dt = isoparse(created_at)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.date().isoformat()
+
+def canonical_json(obj):
+    # The one serialization of a snapshot: stored as-is and hashed, so hashes match the
+    # ones already stored for unchanged data.
+    payload = json.dumps(obj, sort_keys=True)
+    return payload, hashlib.sha256(payload.encode()).hexdigest()
 
 def safe_sync():
     pass
 
-def store_snapshot(type_, scope, data):
-    hash_val = compute_hash(data)
-    row = conn.execute("SELECT hash FROM summary_snapshots WHERE date=? AND type=? AND scope=?", (end_date, type_, scope)).fetchone()
-    if row and row[0] == hash_val:
-        print(f"✅ Skipped unchanged {type_}:{scope}")
+# === Run Metrics ===
+# Every stage records wall time, items processed and per-call latency; main() turns them into
+# a JSON run report (RUN_REPORT_PATH, empty to disable) and, with RUN_REPORT_DB=1, appends
+# it to the pipeline_runs table so nightly runs can be trended.
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH", "pipeline_run.json")
+RUN_REPORT_DB = os.getenv("RUN_REPORT_DB", "0") == "1"
+
+stage_metrics = {}
+_metrics_lock = threading.Lock()
+
+def record_stage(stage, seconds, items=0):
+    rss = peak_rss_mb()
+    with _metrics_lock:
+        m = stage_metrics.setdefault(stage, {"seconds": 0.0, "items": 0, "latencies": [], "peak_rss_mb": 0.0})
+        m["seconds"] += seconds
+        m["items"] += items
+        m["latencies"].append(seconds)
+        m["peak_rss_mb"] = max(m["peak_rss_mb"], rss)
+
+@contextmanager
+def timed(stage):
+    # Callers may set counter["items"] inside the block.
+    counter = {"items": 0}
+    started = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        record_stage(stage, time.perf_counter() - started, counter["items"])
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def run_report(mode, started_at, seconds):
+    stages = {}
+    for stage, m in stage_metrics.items():
+        latencies = sorted(m["latencies"])
+        stages[stage] = {
+            "seconds": round(m["seconds"], 4),
+            "calls": len(latencies),
+            "items": m["items"],
+            "items_per_sec": round(m["items"] / m["seconds"], 2) if m["items"] and m["seconds"] else None,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "peak_rss_mb": round(m["peak_rss_mb"], 1),
+        }
+    return {
+        "started_at": started_at,
+        "mode": mode,
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": stages,
+    }
+
+def write_run_report(report):
+    for stage, m in report["stages"].items():
+        rate = f", {m['items_per_sec']}/s" if m["items_per_sec"] else ""
+        print(f"⏱️ {stage}: {m['seconds']:.2f}s over {m['calls']} calls{rate} (p50 {m['p50_ms']} ms, p99 {m['p99_ms']} ms)")
+    if RUN_REPORT_PATH:
+        with open(RUN_REPORT_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"🧾 Wrote run report to {RUN_REPORT_PATH}")
+    if RUN_REPORT_DB and conn is not None:
+        conn.execute(
+            "INSERT INTO pipeline_runs VALUES (?, ?, ?, ?, ?)",
+            (report["started_at"], report["mode"], report["seconds"], report["peak_rss_mb"], json.dumps(report))
+        )
+        conn.commit()
+        safe_sync()
+
+def store_snapshots(snapshots):
+    # snapshots: {type: data}; every snapshot uses its type as scope. Existing hashes for the
+    # date come back in one query and all changed snapshots are written in one transaction.
+    if not snapshots:
+        return
+    placeholders = ", ".join(["?"] * len(snapshots))
+    existing = dict(conn.execute(
+        f"SELECT type, hash FROM summary_snapshots WHERE date = ? AND type = scope AND type IN ({placeholders})",
+        (end_date, *snapshots)
+    ).fetchall())
+
+    changed = []
+    for type_, data in snapshots.items():
+        payload, hash_val = canonical_json(data)
+        if existing.get(type_) == hash_val:
+            print(f"✅ Skipped unchanged {type_}:{type_}")
+            continue
+        changed.append((end_date, type_, type_, hash_val, payload))
+    if not changed:
         return
-    conn.execute("INSERT OR REPLACE INTO summary_snapshots VALUES (?, ?, ?, ?, ?)", (end_date, type_, scope, hash_val, json.dumps(data)))
+    conn.executemany("INSERT OR REPLACE INTO summary_snapshots VALUES (?, ?, ?, ?, ?)", changed)
     conn.commit()
     safe_sync()
-    print(f"📦 Stored {type_}:{scope}")
+    for _, type_, scope, _, _ in changed:
+        print(f"📦 Stored {type_}:{scope}")
+
+# === Test DB Sync ===
+# Production rows are copied in rowid-keyset chunks and written in one transaction.
+# TEST_SYNC_DAYS > 0 limits the copy to posts/snapshots from the last N days,
+# TEST_SYNC_SAMPLE < 1 copies roughly that fraction of posts (every n-th rowid), and
+# posts are only fetched when newer than the newest ingestion_time already copied.
+TEST_SYNC_CHUNK_SIZE = int(os.getenv("TEST_SYNC_CHUNK_SIZE", "5000"))
+TEST_SYNC_DAYS = int(os.getenv("TEST_SYNC_DAYS", "0"))
+TEST_SYNC_SAMPLE = float(os.getenv("TEST_SYNC_SAMPLE", "1"))
+
+def sync_table(table, filters=(), params=(), replace=False):
+    columns = [d[1] for d in prod_conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    where = " AND ".join(("rowid > ?",) + tuple(filters))
+    insert = (
+        f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['?'] * len(columns))})"
+    )
+    last_rowid = 0
+    total = 0
+    while True:
+        rows = prod_conn.execute(
+            f"SELECT rowid, {', '.join(columns)} FROM {table} WHERE {where} ORDER BY rowid LIMIT ?",
+            (last_rowid, *params, TEST_SYNC_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(insert, [tuple(row[1:]) for row in rows])
+        last_rowid = rows[-1][0]
+        total += len(rows)
+    return total
 
-if IS_TEST:
+def sync_test_db():
     print("🧪 Syncing test DB with production DB...")
+    since = (date.today() - timedelta(days=TEST_SYNC_DAYS)).isoformat() if TEST_SYNC_DAYS > 0 else None
+
+    post_filters, post_params = [], []
+    if since:
+        post_filters.append("created_at >= ?")
+        post_params.append(since)
+    if TEST_SYNC_SAMPLE < 1:
+        post_filters.append("rowid % ? = 0")
+        post_params.append(max(1, round(1 / TEST_SYNC_SAMPLE)))
+    newest = conn.execute("SELECT MAX(ingestion_time) FROM posts").fetchone()[0]
+    if newest:
+        post_filters.append("(ingestion_time > ? OR ingestion_time IS NULL)")
+        post_params.append(newest)
+
+    # Snapshots are small; older dates already copied are skipped and the latest one is
+    # replaced because production may have restored it since.
+    snapshot_filters, snapshot_params = [], []
+    latest = conn.execute("SELECT MAX(date) FROM summary_snapshots").fetchone()[0]
+    if latest or since:
+        snapshot_filters.append("date >= ?")
+        snapshot_params.append(max(d for d in (latest, since) if d))
+
+    synced = {
+        "posts": sync_table("posts", post_filters, post_params),
+        "summary_snapshots": sync_table("summary_snapshots", snapshot_filters, snapshot_params, replace=True),
+    }
+    for table, total in synced.items():
+        if total:
+            print(f"✅ Synced {total} rows into test `{table}` table.")
+        else:
+            print(f"⚠️ No new rows found in production `{table}` table.")
 
-    for table in ["posts", "summary_snapshots"]:
-        # Fetch from prod
-        rows = prod_conn.execute(f"SELECT * FROM {table}").fetchall()
-        columns = [d[1] for d in prod_conn.execute(f"PRAGMA table_info({table})").fetchall()]
-        if not rows:
-            print(f"⚠️ No data found in production `{table}` table.")
-            continue
-        # Insert into test
-        for row in rows:
-            placeholders = ", ".join(["?"] * len(row))
-            conn.execute(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", row)
-
-        print(f"✅ Synced {len(rows)} rows into test `{table}` table.")
+    # Synced posts bypass the insert-time rollups and tag tables, so rebuild them on next use.
+    if synced["posts"]:
+        conn.execute("DELETE FROM pipeline_state WHERE key IN ('rollups_ready', 'tags_ready')")
     conn.commit()
     safe_sync()
 
@@ -125,6 +386,8 @@ def load_models():
 
     DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
+    hf_home = os.path.expanduser(os.getenv("HF_HOME", os.path.expanduser("~/.hf_models")))
+
     if IS_TEST:
         print("🧪 Test mode: downloading models on the fly...")
         sentiment_id = "cardiffnlp/twitter-roberta-base-sentiment"
@@ -147,8 +410,10 @@ def load_models():
         except Exception as e:
             print(f"❌ Failed to load emotion model online: {e}")
             exit(1)
+
+        sent_model_path = os.path.join(hf_home, "test", "sentiment")
+        emot_model_path = os.path.join(hf_home, "test", "emotion")
     else:
-        hf_home = os.getenv("HF_HOME", os.path.expanduser("~/.hf_models"))
         sent_model_path = os.path.expanduser(os.path.join(hf_home, "sentiment"))
         emot_model_path = os.path.expanduser(os.path.join(hf_home, "emotion"))
 
@@ -172,130 +437,1093 @@ def load_models():
             print(f"❌ Failed to load emotion model from cache: {e}")
             exit(1)
 
+    sent_model = select_backend("sentiment", sent_model, sent_tok, sentiment_labels, sent_model_path, DEVICE)
+    emot_model = select_backend("emotion", emot_model, emot_tok, emotion_labels, emot_model_path, DEVICE)
+
     return sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE
 
-# === Label, Migrate, and Generate Snapshots ===
-def hardened_label_and_migrate(sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE):
+# === Labeling Helpers ===
+def preprocess_text(text):
+    # Remove emojis, hashtags, URLs, and mentions
+    text = re.sub(r"#\w+", "", text)
+    text = re.sub(r"http\S+", "", text)
+    text = re.sub(r"@\w+", "", text)
+    text = re.sub(r"[^\w\s]", "", text)
+    return text.lower()
+
+# "tokens" sorts texts by tokenized length and fills each batch up to a padded-token
+# budget, so short posts are no longer padded to the longest post of their slice.
+# "fixed" keeps the old arrival-order slices of LABEL_BATCH_SIZE.
+LABEL_BATCHING = os.getenv("LABEL_BATCHING", "tokens")
+LABEL_BATCH_SIZE = int(os.getenv("LABEL_BATCH_SIZE", "64"))
+LABEL_MAX_LENGTH = 128
+LABEL_TOKEN_BUDGET = int(os.getenv("LABEL_TOKEN_BUDGET", str(LABEL_BATCH_SIZE * LABEL_MAX_LENGTH)))
+
+def plan_batches(lengths):
+    if LABEL_BATCHING != "tokens":
+        return [list(range(i, min(i + LABEL_BATCH_SIZE, len(lengths)))) for i in range(0, len(lengths), LABEL_BATCH_SIZE)]
+
+    batches = []
+    current = []
+    longest = 0
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        padded_len = max(longest, lengths[idx])
+        if current and padded_len * (len(current) + 1) > LABEL_TOKEN_BUDGET:
+            batches.append(current)
+            current = []
+            padded_len = lengths[idx]
+        current.append(idx)
+        longest = padded_len
+    if current:
+        batches.append(current)
+    return batches
+
+def pad_batch(encodings, indices, pad_token_id, DEVICE):
+    import torch
+
+    width = max(len(encodings["input_ids"][i]) for i in indices)
+    inputs = {}
+    for key, values in encodings.items():
+        pad_value = pad_token_id if key == "input_ids" else 0
+        inputs[key] = torch.tensor(
+            [values[i] + [pad_value] * (width - len(values[i])) for i in indices],
+            dtype=torch.long
+        ).to(DEVICE)
+    return inputs
+
+def encode_texts(texts, tokenizer):
+    # Tokenize once without padding; each batch is padded only to its own longest member.
+    encodings = dict(tokenizer(texts, truncation=True, max_length=LABEL_MAX_LENGTH))
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    return encodings, pad_token_id
+
+def infer_encoded(encodings, pad_token_id, model, label_map, DEVICE):
     import torch
     import torch.nn.functional as F
-    
-    def fast_infer(texts, tokenizer, model, label_map):
-        LABEL_BATCH_SIZE = 64
-        results = []
-        for i in range(0, len(texts), LABEL_BATCH_SIZE):
-            batch = texts[i:i + LABEL_BATCH_SIZE]
-            inputs = tokenizer(batch, truncation=True, padding=True, max_length=128, return_tensors="pt").to(DEVICE)
-            with torch.no_grad():
-                logits = model(**inputs).logits
-            probs = F.softmax(logits, dim=-1)
-            preds = torch.argmax(probs, dim=-1)
-            results.extend([label_map[i.item()] for i in preds])
-            del inputs, logits, probs, preds  # Free memory
-            torch.cuda.empty_cache() if DEVICE == "cuda" else None
-        return results
 
-    print("🚀 Starting labeling and snapshot generation process...")
+    results = [None] * len(encodings["input_ids"])
+    for indices in plan_batches([len(ids) for ids in encodings["input_ids"]]):
+        inputs = pad_batch(encodings, indices, pad_token_id, DEVICE)
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        probs = F.softmax(logits, dim=-1)
+        preds = torch.argmax(probs, dim=-1)
+        for idx, pred in zip(indices, preds.tolist()):
+            results[idx] = label_map[pred]
+        del inputs, logits, probs, preds  # Free memory
+        torch.cuda.empty_cache() if DEVICE == "cuda" else None
+    return results
+
+def fast_infer(texts, tokenizer, model, label_map, DEVICE):
+    if not texts:
+        return []
+    encodings, pad_token_id = encode_texts(texts, tokenizer)
+    return infer_encoded(encodings, pad_token_id, model, label_map, DEVICE)
+
+# === Multi-Head Labeling ===
+# Both models use RoBERTa BPE vocabularies, so their heads can share one tokenization
+# pass per batch. Heads only share when the tokenizer definitions are identical.
+LABEL_SHARED_TOKENIZER = os.getenv("LABEL_SHARED_TOKENIZER", "1") == "1"
+
+label_timings = defaultdict(float)  # seconds per tokenization group / model, summed over the run
+_tokenizer_fingerprints = {}
+
+def add_label_timing(key, seconds, items):
+    label_timings[key] += seconds
+    record_stage(key, seconds, items)
+
+def tokenizer_fingerprint(tokenizer):
+    key = id(tokenizer)
+    if key not in _tokenizer_fingerprints:
+        backend = getattr(tokenizer, "backend_tokenizer", None)
+        if backend is not None:
+            spec = json.loads(backend.to_str())
+            # Truncation and padding are call-time settings, not part of the vocabulary.
+            spec.pop("truncation", None)
+            spec.pop("padding", None)
+            payload = json.dumps(spec, sort_keys=True)
+        else:
+            payload = json.dumps(sorted(tokenizer.get_vocab().items()))
+        payload += f"|{type(tokenizer).__name__}|{tokenizer.pad_token_id}"
+        _tokenizer_fingerprints[key] = hashlib.sha256(payload.encode()).hexdigest()
+    return _tokenizer_fingerprints[key]
+
+def multi_head_infer(texts, heads, DEVICE):
+    # heads: [(name, tokenizer, model, label_map)]; a head that fails maps to None.
+    if not texts:
+        return {name: [] for name, *_ in heads}
+
+    groups = defaultdict(list)
+    for head in heads:
+        groups[tokenizer_fingerprint(head[1]) if LABEL_SHARED_TOKENIZER else head[0]].append(head)
+
+    results = {}
+    for group in groups.values():
+        names = "+".join(name for name, *_ in group)
+        started = time.perf_counter()
+        try:
+            encodings, pad_token_id = encode_texts(texts, group[0][1])
+        except Exception as e:
+            print(f"❌ Tokenization for {names} failed: {e}")
+            results.update((name, None) for name, *_ in group)
+            continue
+        add_label_timing(f"tokenize:{names}", time.perf_counter() - started, len(texts))
 
-    # --- Supabase Ingestion ---
-    print("🧹 Fetching unlabeled posts from Supabase...")
+        if label_pool is not None:
+            started = time.perf_counter()
+            results.update(pool_infer_group([name for name, *_ in group], encodings, pad_token_id, DEVICE))
+            add_label_timing(f"pool:{names}", time.perf_counter() - started, len(texts))
+            continue
 
-    start_dt = (datetime.utcnow() - timedelta(days=7)).isoformat() + "Z"
-    end_dt = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + "Z"
+        for name, _, model, label_map in group:
+            started = time.perf_counter()
+            try:
+                results[name] = infer_encoded(encodings, pad_token_id, model, label_map, DEVICE)
+            except Exception as e:
+                print(f"❌ {name.capitalize()} labeling failed: {e}")
+                results[name] = None
+            add_label_timing(f"infer:{name}", time.perf_counter() - started, len(texts))
+    return results
+
+# === Inference Process Pool ===
+# LABEL_WORKERS>1 forks N workers after the models are loaded, so every worker shares
+# the weights copy-on-write. Each worker pins its own intra-op thread count and runs
+# whole planned batches taken from the pool's queue.
+LABEL_WORKERS = int(os.getenv("LABEL_WORKERS", "0"))
+LABEL_THREADS_PER_WORKER = int(os.getenv("LABEL_THREADS_PER_WORKER", "0"))
+
+label_pool = None
+_pool_models = {}  # name -> (model, label_map), inherited by the forked workers
+
+def _init_label_worker(threads):
+    global ONNX_THREADS
+    import torch
 
-    unlabeled_posts = []
-    BATCH_SIZE = 1000
-    MAX_FETCH = 10000
+    torch.set_num_threads(threads)
+    ONNX_THREADS = threads
 
-    for offset in range(0, MAX_FETCH, BATCH_SIZE):
-        if IS_TEST:
-            print(f"🧪 Test mode: Fetching batch {offset // BATCH_SIZE + 1} of unlabeled posts.")
-            batch = supabase.table("posts_unlabeled")\
-                     .select("*")\
-                        .gte("created_at", start_dt)\
-                        .lt("created_at", end_dt)\
-                     .range(offset, offset + BATCH_SIZE - 1)\
-                     .execute().data or []
-        else:  
-            batch = supabase.table("posts_unlabeled")\
-                .select("*")\
-                .gte("created_at", start_dt)\
-                .lt("created_at", end_dt)\
-                .range(offset, offset + BATCH_SIZE - 1)\
-                .execute().data or []
+def _label_worker_batch(job):
+    names, encodings, pad_token_id, DEVICE = job
+    out = {}
+    elapsed = {}
+    for name in names:
+        model, label_map = _pool_models[name]
+        started = time.perf_counter()
+        try:
+            out[name] = infer_encoded(encodings, pad_token_id, model, label_map, DEVICE)
+        except Exception as e:
+            print(f"❌ {name.capitalize()} labeling failed in worker {os.getpid()}: {e}")
+            out[name] = None
+        elapsed[name] = time.perf_counter() - started
+    return out, elapsed
+
+def start_label_pool(heads, DEVICE):
+    global label_pool
+    if LABEL_WORKERS <= 1 or label_pool is not None:
+        return
+    if DEVICE != "cpu":
+        print(f"⚠️ LABEL_WORKERS is CPU-only, labeling in-process on {DEVICE}.")
+        return
 
-        if not batch:
-            break
-        unlabeled_posts.extend(batch)
-        if len(batch) < BATCH_SIZE:
-            break
+    import gc
+    import multiprocessing
+
+    threads = LABEL_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // LABEL_WORKERS)
+    _pool_models.clear()
+    _pool_models.update((name, (model, label_map)) for name, _, model, label_map in heads)
+    # Keep the collector from touching (and so copying) every inherited object page while the
+    # pool runs; stop_label_pool() unfreezes. PyTorch weights are shared copy-on-write, but an
+    # ONNX backend builds its own session (and weight copy) in every worker.
+    gc.freeze()
+    label_pool = multiprocessing.get_context("fork").Pool(
+        LABEL_WORKERS, initializer=_init_label_worker, initargs=(threads,)
+    )
+    print(f"🧵 Started {LABEL_WORKERS} labeling workers × {threads} threads.")
+
+def stop_label_pool():
+    global label_pool
+    if label_pool is not None:
+        import gc
+
+        label_pool.close()
+        label_pool.join()
+        label_pool = None
+        _pool_models.clear()
+        # Objects alive when the pool started go back under the collector.
+        gc.unfreeze()
+
+def pool_infer_group(names, encodings, pad_token_id, DEVICE):
+    batches = plan_batches([len(ids) for ids in encodings["input_ids"]])
+    jobs = (
+        (names, {k: [v[i] for i in indices] for k, v in encodings.items()}, pad_token_id, DEVICE)
+        for indices in batches
+    )
+
+    results = {name: [None] * len(encodings["input_ids"]) for name in names}
+    failed = set()
+    for indices, (out, elapsed) in zip(batches, label_pool.imap(_label_worker_batch, jobs)):
+        for name in names:
+            add_label_timing(f"infer:{name}", elapsed[name], len(indices))
+            if out[name] is None:
+                failed.add(name)
+                continue
+            for idx, label in zip(indices, out[name]):
+                results[name][idx] = label
+    for name in failed:
+        results[name] = None
+    return results
+
+def report_label_timings():
+    if label_timings:
+        print("⏱️ Labeling time: " + ", ".join(f"{k} {v:.2f}s" for k, v in label_timings.items()))
+
+# === ONNX Backend ===
+# LABEL_BACKEND=onnx / onnx-int8 exports the cached checkpoints once to ONNX (optionally
+# dynamic-int8 quantized), keeps the artifacts next to them and serves inference from
+# ONNX Runtime. A backend is only used after agreeing with PyTorch on a sample of posts.
+LABEL_BACKEND = os.getenv("LABEL_BACKEND", "torch")
+ONNX_PARITY_SAMPLE = int(os.getenv("ONNX_PARITY_SAMPLE", "256"))
+ONNX_PARITY_MIN = float(os.getenv("ONNX_PARITY_MIN", "0.98"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 lets ONNX Runtime decide
+
+PARITY_FALLBACK_TEXTS = [
+    "i have been feeling really anxious about work lately and cannot sleep",
+    "therapy has helped me so much this year and i am grateful for my friends",
+    "some days are harder than others but i keep going",
+    "reminder that it is okay to ask for help when you need it",
+    "i am so tired of pretending everything is fine",
+    "today was a good day and i am proud of myself",
+]
+
+class OnnxSequenceClassifier:
+    def __init__(self, path, config, source_weights=None):
+        self.path = path
+        self.config = config
+        # weights_digest() of the PyTorch checkpoint this was exported from.
+        self.source_weights = source_weights
+        self.backend = os.path.basename(path)
+        self._session = None
+        self._pid = None
+
+    def session(self):
+        # ONNX Runtime sessions are not fork-safe, so every process builds its own.
+        if self._session is None or self._pid != os.getpid():
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            if ONNX_THREADS:
+                options.intra_op_num_threads = ONNX_THREADS
+            self._session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+            self._input_names = [i.name for i in self._session.get_inputs()]
+            self._pid = os.getpid()
+        return self._session
+
+    def __call__(self, **inputs):
+        import torch
+        from types import SimpleNamespace
+
+        session = self.session()
+        feed = {k: v.cpu().numpy() for k, v in inputs.items() if k in self._input_names}
+        logits = session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+def export_onnx(model, tokenizer, artifact_dir, quantize):
+    import torch
 
-    if not unlabeled_posts:
-        print("⚠️ No new unlabeled posts found in Supabase.")
-        return
-    print(f"🔍 Found {len(unlabeled_posts)} unlabeled posts for labeling.")
-    def preprocess_text(text):
-        # Remove emojis, hashtags, URLs, and mentions
-        text = re.sub(r"#\w+", "", text)
-        text = re.sub(r"http\S+", "", text)
-        text = re.sub(r"@\w+", "", text)
-        text = re.sub(r"[^\w\s]", "", text)
-        return text.lower()
-    
-    texts = [preprocess_text(post.get("text", ""))[:300] for post in unlabeled_posts if len(post.get("text", "")) > 30]
-    print(f"🔒 Valid posts with URI: {len(unlabeled_posts)}")
-
-    # --- NLP Labeling ---
-    print("🤖 Running sentiment and emotion labeling...")
+    os.makedirs(artifact_dir, exist_ok=True)
+    onnx_path = os.path.join(artifact_dir, "model.onnx")
+    int8_path = os.path.join(artifact_dir, "model.int8.onnx")
+    stamp_path = os.path.join(artifact_dir, "onnx_source.json")
+
+    # Artifacts are tied to the checkpoint they came from (config and weights); a new
+    # checkpoint re-exports.
+    source = model_identity(model, [])
+    stale = True
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            stale = json.load(f).get("source") != source
+    if stale or not os.path.exists(onnx_path):
+        print(f"📤 Exporting ONNX model to {onnx_path}...")
+        sample = tokenizer(["export sample text for onnx"], return_tensors="pt")
+        torch.onnx.export(
+            model.cpu().eval(), (sample["input_ids"], sample["attention_mask"]), onnx_path,
+            input_names=["input_ids", "attention_mask"], output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17, dynamo=False
+        )
+        if os.path.exists(int8_path):
+            os.remove(int8_path)
+        with open(stamp_path, "w") as f:
+            json.dump({"source": source}, f)
+
+    if not quantize:
+        return onnx_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"📤 Quantizing ONNX model to {int8_path}...")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+def parity_sample_texts():
     try:
-        sentiments = fast_infer(texts, sent_tok, sent_model, sentiment_labels)
-    except Exception as e:
-        print(f"❌ Sentiment labeling failed: {e}")
-        sentiments = ["neutral"] * len(texts)
+        rows = conn.execute(
+            "SELECT text FROM posts WHERE length(text) > 30 ORDER BY rowid DESC LIMIT ?", (ONNX_PARITY_SAMPLE,)
+        ).fetchall()
+    except Exception:
+        rows = []
+    texts = [preprocess_text(text)[:300] for (text,) in rows if text]
+    return texts or PARITY_FALLBACK_TEXTS
+
+def select_backend(name, model, tokenizer, label_map, artifact_dir, DEVICE):
+    if LABEL_BACKEND == "torch":
+        return model
+    if LABEL_BACKEND not in ("onnx", "onnx-int8"):
+        print(f"⚠️ Unknown LABEL_BACKEND '{LABEL_BACKEND}', using PyTorch.")
+        return model
+    if DEVICE != "cpu":
+        print(f"⚠️ ONNX backend is CPU-only, keeping PyTorch on {DEVICE} for {name}.")
+        return model
 
     try:
-        emotions = fast_infer(texts, emot_tok, emot_model, emotion_labels)
+        path = export_onnx(model, tokenizer, artifact_dir, quantize=LABEL_BACKEND == "onnx-int8")
+        onnx_model = OnnxSequenceClassifier(path, model.config, weights_digest(model))
+
+        texts = parity_sample_texts()
+        expected = fast_infer(texts, tokenizer, model, label_map, DEVICE)
+        actual = fast_infer(texts, tokenizer, onnx_model, label_map, DEVICE)
+        agreement = sum(a == b for a, b in zip(expected, actual)) / len(texts)
     except Exception as e:
-        print(f"❌ Emotion labeling failed: {e}")
-        emotions = ["neutral"] * len(texts)
+        print(f"❌ ONNX backend for {name} unavailable, using PyTorch: {e}")
+        return model
+
+    if agreement < ONNX_PARITY_MIN:
+        print(f"⚠️ {LABEL_BACKEND} {name} labels agree with PyTorch on {agreement:.1%} of {len(texts)} posts "
+              f"(< {ONNX_PARITY_MIN:.0%}), using PyTorch.")
+        return model
+    print(f"✅ Serving {name} from {LABEL_BACKEND} ({agreement:.1%} parity on {len(texts)} posts).")
+    return onnx_model
+
+# === Label Cache ===
+# Duplicate and reposted texts are labeled once: results are keyed by a hash of the
+# preprocessed text plus the model identity and kept in a local libsql file across runs.
+LABEL_CACHE = os.getenv("LABEL_CACHE", "1") == "1"
+LABEL_CACHE_PATH = os.path.expanduser(os.getenv("LABEL_CACHE_PATH", "~/.cache/cognitivesky/label_cache.db"))
+# Entries not used for LABEL_CACHE_MAX_AGE_DAYS are dropped when the cache is opened, and the
+# least recently used beyond LABEL_CACHE_MAX_ROWS after that, so the cache saved by the
+# workflow stays bounded.
+LABEL_CACHE_MAX_AGE_DAYS = int(os.getenv("LABEL_CACHE_MAX_AGE_DAYS", "30"))
+LABEL_CACHE_MAX_ROWS = int(os.getenv("LABEL_CACHE_MAX_ROWS", "2000000"))
+
+label_cache_conn = None
+_weights_digests = {}
+
+def get_label_cache():
+    global label_cache_conn
+    if not LABEL_CACHE:
+        return None
+    if label_cache_conn is None:
+        try:
+            os.makedirs(os.path.dirname(LABEL_CACHE_PATH) or ".", exist_ok=True)
+            import libsql_experimental as libsql
+
+            label_cache_conn = libsql.connect(LABEL_CACHE_PATH)
+            label_cache_conn.execute("""CREATE TABLE IF NOT EXISTS label_cache (
+                model TEXT,
+                text_hash TEXT,
+                label TEXT,
+                last_used INTEGER,
+                PRIMARY KEY(model, text_hash)
+            ) WITHOUT ROWID""")
+            columns = [row[1] for row in label_cache_conn.execute("PRAGMA table_info(label_cache)").fetchall()]
+            if "last_used" not in columns:
+                label_cache_conn.execute("ALTER TABLE label_cache ADD COLUMN last_used INTEGER")
+            label_cache_conn.execute("CREATE INDEX IF NOT EXISTS idx_label_cache_last_used ON label_cache(last_used)")
+            label_cache_conn.commit()
+            print(f"🗃️ Using label cache at {LABEL_CACHE_PATH}")
+            prune_label_cache(label_cache_conn)
+        except Exception as e:
+            print(f"⚠️ Label cache unavailable, labeling without it: {e}")
+            return None
+    return label_cache_conn
+
+def prune_label_cache(cache):
+    # Rows from before last_used existed count as unused.
+    cutoff = int(time.time()) - LABEL_CACHE_MAX_AGE_DAYS * 86400
+    pruned = cache.execute("DELETE FROM label_cache WHERE last_used IS NULL OR last_used < ?", (cutoff,)).rowcount
+    pruned += cache.execute(
+        """DELETE FROM label_cache WHERE (model, text_hash) IN (
+            SELECT model, text_hash FROM label_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )""",
+        (LABEL_CACHE_MAX_ROWS,)
+    ).rowcount
+    cache.commit()
+    if pruned:
+        print(f"🗃️ Pruned {pruned} stale label cache entries.")
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def weights_digest(model):
+    # Identifies the weights, not just the architecture: the contents of the checkpoint files
+    # when loaded from a local directory (mtimes change whenever identical weights are re-saved),
+    # else the hub commit, else the tensors themselves.
+    key = id(model)
+    if key not in _weights_digests:
+        config = getattr(model, "config", None)
+        source = getattr(config, "_name_or_path", "") or ""
+        files = []
+        if os.path.isdir(source):
+            files = sorted(
+                f for f in os.listdir(source)
+                if f.startswith(("model", "pytorch_model")) and f.endswith((".safetensors", ".bin"))
+            )
+        if getattr(model, "source_weights", None):
+            payload = model.source_weights
+        elif files:
+            digest = hashlib.sha256()
+            for f in files:
+                digest.update(f.encode())
+                with open(os.path.join(source, f), "rb") as fh:
+                    for block in iter(lambda: fh.read(1 << 20), b""):
+                        digest.update(block)
+            payload = digest.hexdigest()
+        elif getattr(config, "_commit_hash", None):
+            payload = f"{source}@{config._commit_hash}"
+        elif hasattr(model, "state_dict"):
+            import torch
+
+            digest = hashlib.sha256()
+            for name, tensor in model.state_dict().items():
+                digest.update(name.encode())
+                digest.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+            payload = digest.hexdigest()
+        else:
+            payload = repr(model)
+        _weights_digests[key] = hashlib.sha256(payload.encode()).hexdigest()
+    return _weights_digests[key]
+
+def model_identity(model, label_map):
+    config = getattr(model, "config", None)
+    config_json = config.to_json_string() if config is not None else repr(model)
+    if getattr(model, "backend", None):
+        config_json += model.backend
+    payload = config_json + weights_digest(model) + json.dumps(list(label_map))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def lookup_cached_labels(cache, model_key, keys, now):
+    labels = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ", ".join(["?"] * len(chunk))
+        rows = cache.execute(
+            f"SELECT text_hash, label FROM label_cache WHERE model = ? AND text_hash IN ({placeholders})",
+            (model_key, *chunk)
+        ).fetchall()
+        labels.update(rows)
+        if rows:
+            hits = [h for h, _ in rows]
+            cache.execute(
+                f"UPDATE label_cache SET last_used = ? WHERE model = ? AND text_hash IN ({', '.join(['?'] * len(hits))})",
+                (now, model_key, *hits)
+            )
+    return labels
+
+def cached_multi_infer(texts, heads, DEVICE):
+    cache = get_label_cache()
+    if cache is None:
+        return multi_head_infer(texts, heads, DEVICE)
+
+    hashes = [text_hash(t) for t in texts]
+    unique = dict(zip(hashes, texts))  # in-batch dedupe
+    keys = list(unique)
+
+    now = int(time.time())
+    model_keys = {name: model_identity(model, label_map) for name, _, model, label_map in heads}
+    known = {name: lookup_cached_labels(cache, model_keys[name], keys, now) for name in model_keys}
+
+    # Texts missed by any head are run through all heads so they still share tokenization.
+    missing = [h for h in keys if any(h not in labels for labels in known.values())]
+    if missing:
+        inferred = multi_head_infer([unique[h] for h in missing], heads, DEVICE)
+        for name, labels in inferred.items():
+            if labels is None:
+                continue
+            known[name].update(zip(missing, labels))
+            cache.executemany(
+                "INSERT OR REPLACE INTO label_cache VALUES (?, ?, ?, ?)",
+                [(model_keys[name], h, label, now) for h, label in zip(missing, labels)]
+            )
+    cache.commit()
+
+    print(f"🗃️ Label cache: {len(texts)} texts, {len(unique)} unique, {len(unique) - len(missing)} cached, {len(missing)} inferred.")
+    return {
+        name: [labels[h] for h in hashes] if all(h in labels for h in keys) else None
+        for name, labels in known.items()
+    }
 
-    # --- Topic Modeling ---
-    print("🧠 Performing topic modeling...")
+def neutral_label(labels):
+    # The head's own neutral class, so fallback labels land in the same bucket as real ones:
+    # "neutral" where the head has it, else the middle class (label_1 of the 3-way sentiment head).
+    return "neutral" if "neutral" in labels else labels[len(labels) // 2]
+
+def label_posts(posts, sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE):
+    # Only posts with enough text are labeled; labels stay aligned with `valid`.
+    with timed("preprocess") as t:
+        valid = [post for post in posts if len(post.get("text") or "") > 30]
+        texts = [preprocess_text(post.get("text") or "")[:300] for post in valid]
+        t["items"] = len(posts)
+
+    heads = [
+        ("sentiment", sent_tok, sent_model, sentiment_labels),
+        ("emotion", emot_tok, emot_model, emotion_labels),
+    ]
     try:
-        vectorizer = TfidfVectorizer(max_features=200, stop_words='english')
-        X = vectorizer.fit_transform(texts)
+        results = cached_multi_infer(texts, heads, DEVICE)
+    except Exception as e:
+        print(f"❌ Labeling failed: {e}")
+        results = {}
+
+    fallback = (neutral_label(sentiment_labels), neutral_label(emotion_labels))
+    sentiments = results.get("sentiment") or [fallback[0]] * len(texts)
+    emotions = results.get("emotion") or [fallback[1]] * len(texts)
+
+    return {
+        "posts": posts, "valid": valid, "texts": texts, "sentiments": sentiments, "emotions": emotions,
+        "fallback": fallback,
+    }
+
+# === Topic Modeling ===
+# The topic model is persisted in the topic_model table: the featurizer state, document
+# frequencies for a streaming IDF, and the NMF components. Each run warm-starts
+# MiniBatchNMF from the stored components and partial_fits it on the new posts, so topic_k
+# keeps its meaning from one day to the next. TOPIC_MODEL_RESET=1 refits from scratch.
+#
+# TOPIC_FEATURIZER=vocabulary (default) fixes a TOPIC_VOCAB_SIZE vocabulary on a first fit
+# window. TOPIC_FEATURIZER=hashing needs no vocabulary: texts are hashed into
+# TOPIC_HASH_FEATURES buckets and streamed in TOPIC_CHUNK_SIZE chunks from the first batch,
+# and a bounded heavy-hitters word counter maps buckets back to words for topic labels.
+TOPIC_COMPONENTS = 8
+TOPIC_VOCAB_SIZE = 200
+TOPIC_MODEL_RESET = os.getenv("TOPIC_MODEL_RESET", "0") == "1"
+TOPIC_FEATURIZER = os.getenv("TOPIC_FEATURIZER", "vocabulary")
+TOPIC_HASH_FEATURES = int(os.getenv("TOPIC_HASH_FEATURES", str(2 ** 13)))
+TOPIC_CHUNK_SIZE = int(os.getenv("TOPIC_CHUNK_SIZE", "2000"))
+TOPIC_WORD_CAPACITY = int(os.getenv("TOPIC_WORD_CAPACITY", "5000"))
+
+class TopicModel:
+    def __init__(self, vocabulary=None, doc_freq=None, n_docs=0, components=None, n_features=None, word_counts=None):
+        import numpy as np
+
+        self.featurizer = "hashing" if vocabulary is None else "vocabulary"
+        self.vocabulary = None if vocabulary is None else list(vocabulary)
+        self.n_features = len(self.vocabulary) if vocabulary is not None else n_features
+        self.doc_freq = np.zeros(self.n_features) if doc_freq is None else np.asarray(doc_freq, dtype=float)
+        self.n_docs = n_docs
+        self.components = None if components is None else np.asarray(components, dtype=float)
+        self.word_counts = None
+        if self.featurizer == "hashing":
+            self.word_counts = HeavyHitterCounter(TOPIC_WORD_CAPACITY, dict(word_counts or []))
+        self._counter = None
+        self._nmf = None
+
+    def counts(self, texts):
+        if self._counter is None:
+            from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+            if self.featurizer == "hashing":
+                self._counter = HashingVectorizer(
+                    n_features=self.n_features, alternate_sign=False, norm=None, stop_words="english"
+                )
+            else:
+                self._counter = CountVectorizer(vocabulary=self.vocabulary)
+        return self._counter.transform(texts)
+
+    def tfidf(self, counts):
+        # Same weighting as TfidfVectorizer (smooth idf, l2 norm), with the IDF taken from
+        # every document seen so far rather than from this batch alone.
+        import numpy as np
+        from sklearn.preprocessing import normalize
+
+        idf = np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+        return normalize(counts.multiply(idf).tocsr())
+
+    def partial_fit(self, texts):
+        # Hashed features are streamed in fixed-size chunks; the vocabulary featurizer takes
+        # the whole batch so the cold fit matches a one-shot fit.
+        chunk_size = TOPIC_CHUNK_SIZE if self.featurizer == "hashing" else max(len(texts), 1)
+        for i in range(0, len(texts), chunk_size):
+            self._partial_fit_chunk(texts[i:i + chunk_size])
+        return self
+
+    def _partial_fit_chunk(self, texts):
+        import numpy as np
         from sklearn.decomposition import MiniBatchNMF
-        nmf = MiniBatchNMF(n_components=8, random_state=42, batch_size=128)
-        W = nmf.fit_transform(X)
-        topic_words = [
-            [vectorizer.get_feature_names_out()[i] for i in topic.argsort()[:-6:-1]]
-            for topic in nmf.components_
-        ]
-        topics = [f"topic_{i}" for i in W.argmax(axis=1)]
+
+        counts = self.counts(texts)
+        self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+        if self.word_counts is not None:
+            analyze = self._counter.build_analyzer()
+            for text in texts:
+                self.word_counts.update(analyze(text))
+        X = self.tfidf(counts)
+        if self._nmf is not None:
+            self._nmf.partial_fit(X)
+        elif self.components is None and self.featurizer == "vocabulary":
+            # Cold start: a full fit, as the per-run model used to do.
+            self._nmf = MiniBatchNMF(n_components=TOPIC_COMPONENTS, random_state=42, batch_size=128)
+            self._nmf.fit(X)
+        elif self.components is None:
+            self._nmf = MiniBatchNMF(n_components=TOPIC_COMPONENTS, random_state=42, batch_size=128)
+            self._nmf.partial_fit(X)
+        else:
+            # Warm start from the stored components; W is re-solved for every batch.
+            self._nmf = MiniBatchNMF(
+                n_components=TOPIC_COMPONENTS, init="custom", fresh_restarts=True, random_state=42, batch_size=128
+            )
+            self._nmf.partial_fit(X, W=np.ones((X.shape[0], TOPIC_COMPONENTS)), H=self.components.copy())
+        self.components = self._nmf.components_
+
+    def transform(self, texts):
+        return self._nmf.transform(self.tfidf(self.counts(texts)))
+
+    def topic_words(self):
+        if self.featurizer == "vocabulary":
+            return [[self.vocabulary[i] for i in topic.argsort()[:-6:-1]] for topic in self.components]
+
+        # Each bucket is labeled with the most frequent tracked word that hashes into it.
+        words = [w for w, _ in self.word_counts.most_common()]
+        bucket_words = {}
+        if words:
+            hashed = self.counts(words)
+            for row, word in enumerate(words):
+                for bucket in hashed.indices[hashed.indptr[row]:hashed.indptr[row + 1]]:
+                    bucket_words.setdefault(int(bucket), word)
+        topic_words = []
+        for topic in self.components:
+            labels = [bucket_words[b] for b in topic.argsort()[::-1].tolist() if b in bucket_words]
+            topic_words.append(labels[:5] or ["general"])
+        return topic_words
+
+    def to_json(self):
+        return {
+            "featurizer": self.featurizer,
+            "vocabulary": self.vocabulary,
+            "n_features": self.n_features,
+            "doc_freq": self.doc_freq.tolist(),
+            "n_docs": self.n_docs,
+            "components": self.components.tolist(),
+            "word_counts": list(self.word_counts.items()) if self.word_counts is not None else None,
+        }
+
+def load_topic_model():
+    row = conn.execute("SELECT data FROM topic_model WHERE name = 'default'").fetchone()
+    if not row:
+        return None
+    try:
+        data = json.loads(row[0])
+        featurizer = data.get("featurizer", "vocabulary")
+        if featurizer != TOPIC_FEATURIZER or (featurizer == "hashing" and data["n_features"] != TOPIC_HASH_FEATURES):
+            print(f"⚠️ Stored topic model uses a different featurizer ({featurizer}); starting a new one.")
+            return None
+        return TopicModel(
+            data["vocabulary"], data["doc_freq"], data["n_docs"], data["components"],
+            data.get("n_features"), data.get("word_counts")
+        )
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable stored topic model: {e}")
+        return None
+
+def save_topic_model(topic_model):
+    conn.execute(
+        "INSERT OR REPLACE INTO topic_model VALUES ('default', ?, ?)",
+        (json.dumps(topic_model.to_json()), datetime.utcnow().isoformat() + "Z")
+    )
+    conn.commit()
+    safe_sync()
+
+def fit_topic_model(texts):
+    # Cold start: the vocabulary is the TOPIC_VOCAB_SIZE strongest TF-IDF terms of the first
+    # fit window and stays fixed afterwards.
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    try:
+        vectorizer = TfidfVectorizer(max_features=TOPIC_VOCAB_SIZE, stop_words='english')
+        vectorizer.fit(texts)
+        return TopicModel(vectorizer.get_feature_names_out()).partial_fit(texts)
     except Exception as e:
         print(f"❌ Topic modeling failed: {e}. Assigning 'topic_0' by default.")
-        topics = ["topic_0"] * len(texts)
-        topic_words = [["general"]] * 8
+        return None
 
-    # --- Turso Migration ---
-    from math import ceil
+def update_topic_model(topic_model, texts):
+    try:
+        topic_model.partial_fit(texts)
+    except Exception as e:
+        print(f"❌ Topic model update failed: {e}. Keeping the previous components.")
 
-    print("🧬 Migrating labeled posts to Turso DB (chunked bulk mode)...")
+def assign_topics(topic_model, texts):
+    if topic_model is None or topic_model._nmf is None or not texts:
+        return ["topic_0"] * len(texts)
+    try:
+        W = topic_model.transform(texts)
+        return [f"topic_{i}" for i in W.argmax(axis=1)]
+    except Exception as e:
+        print(f"❌ Topic assignment failed: {e}. Assigning 'topic_0' by default.")
+        return ["topic_0"] * len(texts)
+
+# === Post Sources ===
+# Where unlabeled posts come from. Every source pages a created_at window in (created_at, uri)
+# keyset order and deletes posts by URI once they are migrated, so the labeling run can read
+# from a local SQLite or JSONL file instead of Supabase and run fully offline:
+#   POSTS_SOURCE=supabase (default) reads and deletes from the posts_unlabeled table.
+#   POSTS_SOURCE=sqlite reads a posts_unlabeled table in the (lib)SQLite file POSTS_SOURCE_PATH.
+#   POSTS_SOURCE=jsonl reads one post per line from POSTS_SOURCE_PATH.
+# POSTS_SOURCE_DELETE=0 leaves migrated posts in the source, e.g. to replay a local fixture.
+POSTS_SOURCE = os.getenv("POSTS_SOURCE", "supabase")
+POSTS_SOURCE_PATH = os.getenv("POSTS_SOURCE_PATH", "")
+POSTS_SOURCE_DELETE = os.getenv("POSTS_SOURCE_DELETE", "1") == "1"
+POST_COLUMNS = ("uri", "did", "text", "created_at", "langs", "facets", "reply", "embed", "ingestion_time")
+JSON_POST_COLUMNS = ("langs", "facets", "reply", "embed")
+
+class SupabaseSource:
+    name = "Supabase"
+
+    def __init__(self, client):
+        self.client = client
+
+    def fetch_window(self, start_dt, end_dt, cursor, limit):
+        query = self.client.table("posts_unlabeled")\
+            .select("*")\
+            .gte("created_at", start_dt)\
+            .lt("created_at", end_dt)
+        if cursor:
+            created_at, uri = cursor
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",uri.gt."{uri}")')
+        return query.order("created_at").order("uri").limit(limit).execute().data or []
+
+    def delete_uris(self, uris):
+        for i in range(0, len(uris), 100):
+            self.client.table("posts_unlabeled").delete().in_("uri", uris[i:i + 100]).execute()
+
+    def close(self):
+        pass
+
+class SqliteSource:
+    # The table mirrors posts_unlabeled, with the JSON columns stored as JSON text.
+    name = "SQLite"
+
+    def __init__(self, path):
+        import libsql_experimental as libsql
+
+        self.conn = libsql.connect(path)
+        # The fetcher and writer threads of PIPELINE_MODE share this connection.
+        self.lock = threading.Lock()
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS posts_unlabeled ({', '.join(POST_COLUMNS)}, PRIMARY KEY (uri))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_unlabeled_created ON posts_unlabeled(created_at, uri)")
+        self.conn.commit()
+
+    def add_posts(self, posts):
+        rows = [
+            tuple(json.dumps(post.get(c)) if c in JSON_POST_COLUMNS else post.get(c) for c in POST_COLUMNS)
+            for post in posts
+        ]
+        with self.lock:
+            self.conn.executemany(f"INSERT OR REPLACE INTO posts_unlabeled VALUES ({', '.join('?' * len(POST_COLUMNS))})", rows)
+            self.conn.commit()
+
+    def fetch_window(self, start_dt, end_dt, cursor, limit):
+        sql = f"SELECT {', '.join(POST_COLUMNS)} FROM posts_unlabeled WHERE created_at >= ? AND created_at < ?"
+        params = (start_dt, end_dt)
+        if cursor:
+            sql += " AND (created_at > ? OR (created_at = ? AND uri > ?))"
+            params += (cursor[0], cursor[0], cursor[1])
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY created_at, uri LIMIT ?", params + (limit,)).fetchall()
+        posts = []
+        for row in rows:
+            post = dict(zip(POST_COLUMNS, row))
+            for c in JSON_POST_COLUMNS:
+                post[c] = json.loads(post[c]) if post[c] else None
+            posts.append(post)
+        return posts
+
+    def delete_uris(self, uris):
+        with self.lock:
+            for i in range(0, len(uris), 500):
+                chunk = tuple(uris[i:i + 500])
+                self.conn.execute(f"DELETE FROM posts_unlabeled WHERE uri IN ({', '.join('?' * len(chunk))})", chunk)
+            self.conn.commit()
+
+    def close(self):
+        pass
+
+class JsonlSource:
+    # A file is indexed once by (created_at, uri, byte offset), so pages seek straight to their
+    # lines instead of holding every post in memory. Deletes are applied on close() by
+    # rewriting the file without the deleted URIs.
+    name = "JSONL"
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.deleted = set()
+
+    def add_posts(self, posts):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for post in posts:
+                f.write(json.dumps(post, ensure_ascii=False) + "\n")
+        self.index = None
+
+    def load_index(self):
+        index = []
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.strip():
+                        post = json.loads(line)
+                        index.append((post.get("created_at") or "", post.get("uri") or "", offset))
+                    offset += len(line)
+        index.sort()
+        return index
+
+    def fetch_window(self, start_dt, end_dt, cursor, limit):
+        from bisect import bisect_left, bisect_right
+
+        if self.index is None:
+            self.index = self.load_index()
+        pos = bisect_left(self.index, (start_dt,))
+        if cursor:
+            pos = max(pos, bisect_right(self.index, (cursor[0], cursor[1], float("inf"))))
+        posts = []
+        with open(self.path, "rb") as f:
+            for created_at, uri, offset in islice(self.index, pos, None):
+                if created_at >= end_dt or len(posts) >= limit:
+                    break
+                if uri in self.deleted:
+                    continue
+                f.seek(offset)
+                posts.append(json.loads(f.readline()))
+        return posts
+
+    def delete_uris(self, uris):
+        self.deleted.update(uris)
+
+    def close(self):
+        if not self.deleted or not os.path.exists(self.path):
+            return
+        tmp_path = self.path + ".tmp"
+        with open(self.path, encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                if line.strip() and json.loads(line).get("uri") not in self.deleted:
+                    dst.write(line)
+        os.replace(tmp_path, self.path)
+        print(f"🧹 Removed {len(self.deleted)} migrated posts from {self.path}.")
+        self.deleted = set()
+        self.index = None
+
+def connect_source():
+    global posts_source
+    if POSTS_SOURCE == "supabase":
+        connect_supabase()
+        posts_source = SupabaseSource(supabase)
+    elif POSTS_SOURCE in ("sqlite", "jsonl"):
+        if not POSTS_SOURCE_PATH:
+            print(f"❌ POSTS_SOURCE={POSTS_SOURCE} needs POSTS_SOURCE_PATH.")
+            exit(1)
+        posts_source = (SqliteSource if POSTS_SOURCE == "sqlite" else JsonlSource)(POSTS_SOURCE_PATH)
+    else:
+        print(f"❌ Unknown POSTS_SOURCE '{POSTS_SOURCE}'. Use supabase, sqlite or jsonl.")
+        exit(1)
+    print(f"📥 Reading unlabeled posts from {posts_source.name}.")
 
-    insert_sql = """
-        INSERT OR IGNORE INTO posts (
-            uri, did, text, created_at, langs, facets, reply, embed,
-            ingestion_time, sentiment, emotion, topic
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
+# === Ingestion ===
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "1000"))
+TOPIC_FIT_SIZE = int(os.getenv("TOPIC_FIT_SIZE", "10000"))
 
+def load_state(key):
+    row = conn.execute("SELECT value FROM pipeline_state WHERE key=?", (key,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+def save_state(key, value):
+    conn.execute("INSERT OR REPLACE INTO pipeline_state VALUES (?, ?)", (key, json.dumps(value)))
+    conn.commit()
+    safe_sync()
+
+def clear_state(key):
+    conn.execute("DELETE FROM pipeline_state WHERE key=?", (key,))
+    conn.commit()
+    safe_sync()
+
+def load_ingest_cursor(start_dt):
+    state = load_state("ingest_cursor")
+    # A cursor left behind by an older window is stale; start from the window edge.
+    if not state or state["created_at"] < start_dt:
+        return None
+    return state["created_at"], state["uri"]
+
+def fetch_unlabeled_batches(start_dt, end_dt, cursor=None):
+    # Keyset pagination on (created_at, uri): every page is an index range scan
+    # in the source no matter how deep into the backlog we are.
+    page = 0
+    while True:
+        page += 1
+        if IS_TEST:
+            print(f"🧪 Test mode: Fetching batch {page} of unlabeled posts.")
+        with timed("fetch") as t:
+            batch = posts_source.fetch_window(start_dt, end_dt, cursor, FETCH_BATCH_SIZE)
+            t["items"] = len(batch)
+
+        if not batch:
+            return
+        yield batch
+        cursor = (batch[-1]["created_at"], batch[-1]["uri"])
+        if len(batch) < FETCH_BATCH_SIZE:
+            return
+
+# === Turso Migration ===
+insert_sql = """
+    INSERT OR IGNORE INTO posts (
+        uri, did, text, created_at, langs, facets, reply, embed,
+        ingestion_time, sentiment, emotion, topic, day
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# === Rollups ===
+# Per-day counts maintained at insert time, so the all-time "complete" block of the meta
+# snapshot is a handful of aggregate queries instead of a scan of every stored post.
+def rollup_counts(rows):
+    # rows: (created_at, sentiment, emotion, topic, langs_json, hashtags, emojis)
+    counts = Counter()
+    for created_at, sentiment, emotion, topic, langs_json, hashtags, emojis in rows:
+        day = post_day(created_at) or ""
+        counts[(day, "posts", "")] += 1
+        counts[(day, "sentiment", sentiment)] += 1
+        counts[(day, "emotion", emotion)] += 1
+        counts[(day, "topic", topic)] += 1
+        for l in json.loads(langs_json or "[]"):
+            counts[(day, "language", l)] += 1
+        for h in hashtags:
+            counts[(day, "hashtag", h)] += 1
+        for e in emojis:
+            counts[(day, "emoji", e)] += 1
+    return counts
+
+def apply_rollups(counts):
+    if not counts:
+        return
+    conn.executemany(
+        """INSERT INTO daily_rollup VALUES (?, ?, ?, ?)
+        ON CONFLICT(day, kind, key) DO UPDATE SET count = count + excluded.count""",
+        [(day, kind, key if key is not None else "", n) for (day, kind, key), n in counts.items()]
+    )
+
+def ensure_rollups():
+    # One-time backfill for posts stored before rollups existed (or synced around them).
+    if load_state("rollups_ready"):
+        return
+    print("🧮 Building daily rollups from stored posts (one-time backfill)...")
+    conn.execute("DELETE FROM daily_rollup")
+    last_rowid = 0
+    total = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, created_at, sentiment, emotion, topic, langs, text FROM posts WHERE rowid > ? ORDER BY rowid LIMIT 5000",
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        apply_rollups(rollup_counts(row[1:6] + extract_tags(row[6]) for row in rows))
+        last_rowid = rows[-1][0]
+        total += len(rows)
+    save_state("rollups_ready", True)
+    print(f"✅ Rolled up {total} posts.")
+
+# === Tag Tables ===
+def tag_rows(uri, day, hashtags, emojis):
+    return (
+        [(uri, pos, tag, day) for pos, tag in enumerate(hashtags)],
+        [(uri, pos, emoji, day) for pos, emoji in enumerate(emojis)],
+    )
+
+def apply_tags(hashtag_rows, emoji_rows):
+    if hashtag_rows:
+        conn.executemany("INSERT OR IGNORE INTO post_hashtags VALUES (?, ?, ?, ?)", hashtag_rows)
+    if emoji_rows:
+        conn.executemany("INSERT OR IGNORE INTO post_emojis VALUES (?, ?, ?, ?)", emoji_rows)
+
+def ensure_tags():
+    # One-time backfill for posts stored before the tag tables existed (or synced around them).
+    # Posts are walked in rowid order so tag rowids follow post order, which the snapshot
+    # queries rely on for first-seen ordering.
+    if load_state("tags_ready"):
+        return
+    print("🏷️ Extracting hashtags and emojis from stored posts (one-time backfill)...")
+    conn.execute("DELETE FROM post_hashtags")
+    conn.execute("DELETE FROM post_emojis")
+    last_rowid = 0
+    total = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, uri, day, text FROM posts WHERE rowid > ? ORDER BY rowid LIMIT 5000",
+            (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        hashtag_rows, emoji_rows = [], []
+        for _, uri, day, text in rows:
+            hashtags, emojis = tag_rows(uri, day, *extract_tags(text))
+            hashtag_rows.extend(hashtags)
+            emoji_rows.extend(emojis)
+        apply_tags(hashtag_rows, emoji_rows)
+        last_rowid = rows[-1][0]
+        total += len(rows)
+    save_state("tags_ready", True)
+    print(f"✅ Extracted tags from {total} posts.")
+
+def rollup_totals():
+    ensure_rollups()
+    total_posts = conn.execute("SELECT COALESCE(SUM(count), 0) FROM daily_rollup WHERE kind = 'posts'").fetchone()[0]
+    distinct = dict(conn.execute(
+        "SELECT kind, COUNT(DISTINCT key) FROM daily_rollup WHERE kind != 'posts' GROUP BY kind"
+    ).fetchall())
+
+    def top(kind):
+        row = conn.execute(
+            "SELECT key FROM daily_rollup WHERE kind = ? GROUP BY key ORDER BY SUM(count) DESC, key LIMIT 1", (kind,)
+        ).fetchone()
+        return row[0] if row else None
+
+    return {
+        "total_posts": total_posts,
+        "total_sentiments": distinct.get("sentiment", 0),
+        "total_emotions": distinct.get("emotion", 0),
+        "total_languages": distinct.get("language", 0),
+        "total_topics": distinct.get("topic", 0),
+        "total_hashtags": distinct.get("hashtag", 0),
+        "total_emojis": distinct.get("emoji", 0),
+    }, top("hashtag"), top("emoji")
+
+def migrate_labeled(labeled, topics):
+    # Posts too short to label are stored as well, with the models' own neutral labels and
+    # topic_0 (the fallbacks used when labeling fails), so every post deleted from the source
+    # reaches Turso.
+    labels = {
+        id(post): (sentiment, emotion, topic)
+        for post, sentiment, emotion, topic in zip(labeled["valid"], labeled["sentiments"], labeled["emotions"], topics)
+    }
     values = []
-    for i, post in enumerate(unlabeled_posts):
+    for post in labeled["posts"]:
+        sentiment, emotion, topic = labels.get(id(post), (*labeled["fallback"], "topic_0"))
         try:
             values.append((
                 post.get("uri"), post.get("did"), post.get("text"), post.get("created_at"),
                 json.dumps(post.get("langs", [])), json.dumps(post.get("facets")),
                 json.dumps(post.get("reply")), json.dumps(post.get("embed")),
-                post.get("ingestion_time"), sentiments[i], emotions[i], topics[i]
+                post.get("ingestion_time"), sentiment, emotion, topic, post_day(post.get("created_at"))
             ))
         except Exception as e:
             print(f"❌ Failed to prepare post {post.get('uri')}: {e}")
@@ -307,123 +1535,686 @@ def hardened_label_and_migrate(sent_tok, sent_model, sentiment_labels, emot_tok,
     try:
         for i in range(0, total, chunk_size):
             chunk = values[i:i+chunk_size]
+            # Only posts that are actually new count towards the rollups.
+            uris = [v[0] for v in chunk]
+            placeholders = ", ".join(["?"] * len(uris))
+            seen = {row[0] for row in conn.execute(f"SELECT uri FROM posts WHERE uri IN ({placeholders})", tuple(uris)).fetchall()}
+            new_rows = []
+            hashtag_rows, emoji_rows = [], []
+            for v in chunk:
+                if v[0] not in seen:
+                    seen.add(v[0])
+                    hashtags, emojis = extract_tags(v[2])
+                    new_rows.append((v[3], v[9], v[10], v[11], v[4], hashtags, emojis))
+                    post_hashtags, post_emojis = tag_rows(v[0], v[12], hashtags, emojis)
+                    hashtag_rows.extend(post_hashtags)
+                    emoji_rows.extend(post_emojis)
             conn.executemany(insert_sql, chunk)
+            apply_rollups(rollup_counts(new_rows))
+            apply_tags(hashtag_rows, emoji_rows)
             inserted_total += len(chunk)
-            print(f"✅ Inserted {inserted_total}/{total} posts...", flush=True)
         conn.commit()
         safe_sync()
     except Exception as e:
         print(f"❌ Bulk insert failed at {inserted_total}/{total}: {e}")
         exit(1)
 
-    print(f"✅ Successfully migrated {inserted_total} posts to Turso DB.")
+    return inserted_total
 
-    # --- Supabase Cleanup ---
+def delete_from_source(posts):
     try:
-        uris = [p["uri"] for p in unlabeled_posts if p.get("uri")]
-        if not IS_TEST:
-            print("🗑️ Deleting processed posts from Supabase...")
-            for i in range(0, len(uris), 100):
-                supabase.table("posts_unlabeled").delete().in_("uri", uris[i:i + 100]).execute()
-            print("✅ Supabase cleared of migrated posts.")
-        else:
-            print("🧪 Test mode: Skipped Supabase deletion.")
+        uris = [p["uri"] for p in posts if p.get("uri")]
+        if not IS_TEST and POSTS_SOURCE_DELETE:
+            posts_source.delete_uris(uris)
     except Exception as e:
-        print(f"❌ Failed to clean Supabase: {e}")
+        print(f"❌ Failed to clean {posts_source.name}: {e}")
+
+# === Staged Pipeline ===
+PIPELINE_MODE = os.getenv("PIPELINE_MODE") == "1"
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+
+_PIPELINE_DONE = object()
+
+def _pipeline_put(q, item, failed):
+    # Blocks while the queue is full (back-pressure), but gives up once any stage failed.
+    while not failed.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _pipeline_get(q, failed):
+    while True:
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            if failed.is_set():
+                return _PIPELINE_DONE
+
+def run_pipelined(batches, label_stage, write_stage):
+    # fetcher thread -> label_stage (this thread) -> writer thread, joined by bounded
+    # queues so at most PIPELINE_QUEUE_SIZE pages wait between any two stages.
+    fetch_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    failed = threading.Event()
+    errors = []
+
+    def fetcher():
+        try:
+            for batch in batches:
+                if not _pipeline_put(fetch_q, batch, failed):
+                    return
+        except BaseException as e:
+            print(f"❌ Fetch stage failed: {e}")
+            errors.append(e)
+            failed.set()
+        finally:
+            _pipeline_put(fetch_q, _PIPELINE_DONE, failed)
+
+    def writer():
+        try:
+            while True:
+                item = _pipeline_get(write_q, failed)
+                if item is _PIPELINE_DONE:
+                    return
+                write_stage(*item)
+        except BaseException as e:
+            print(f"❌ Write stage failed: {e}")
+            errors.append(e)
+            failed.set()
+
+    def fetched():
+        while True:
+            batch = _pipeline_get(fetch_q, failed)
+            if batch is _PIPELINE_DONE:
+                return
+            yield batch
+
+    threads = [
+        threading.Thread(target=fetcher, name="pipeline-fetcher", daemon=True),
+        threading.Thread(target=writer, name="pipeline-writer", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        for item in label_stage(fetched()):
+            if not _pipeline_put(write_q, item, failed):
+                break
+    except BaseException as e:
+        print(f"❌ Label stage failed: {e}")
+        errors.append(e)
+        failed.set()
+    finally:
+        _pipeline_put(write_q, _PIPELINE_DONE, failed)
+
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+# === Label, Migrate, and Generate Snapshots ===
+def hardened_label_and_migrate(sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE):
+    print("🚀 Starting labeling and snapshot generation process...")
+
+    # --- Ingestion ---
+    print(f"🧹 Streaming unlabeled posts from {posts_source.name}...")
+
+    start_dt = (datetime.utcnow() - timedelta(days=7)).isoformat() + "Z"
+    end_dt = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat() + "Z"
+
+    cursor = load_ingest_cursor(start_dt)
+    if cursor:
+        print(f"⏩ Resuming ingestion after cursor ({cursor[0]}, {cursor[1]})")
+    if IS_TEST:
+        print(f"🧪 Test mode: Skipping {posts_source.name} deletion.")
+
+    # A stored topic model is warm-started and updated batch by batch. Without one, the
+    # first TOPIC_FIT_SIZE texts of the run are buffered for a cold fit, after which later
+    # batches update it too, so memory stays bounded by that window.
+    topic_model = None if TOPIC_MODEL_RESET else load_topic_model()
+    if topic_model is not None:
+        print(f"🧠 Warm-starting stored topic model ({topic_model.n_docs} documents seen so far).")
+    elif TOPIC_FEATURIZER == "hashing":
+        print(f"🧠 Streaming a new hashed topic model ({TOPIC_HASH_FEATURES} features) from the first batch.")
+        topic_model = TopicModel(n_features=TOPIC_HASH_FEATURES)
+    topic_fitted = topic_model is not None
+    fetched_total = 0
+    migrated_total = 0
+
+    def fit_pending(pending):
+        nonlocal topic_model, topic_fitted
+        fit_texts = [t for labeled in pending for t in labeled["texts"]]
+        print(f"🧠 Fitting topic model on {len(fit_texts)} texts...")
+        with timed("topics") as t:
+            topic_model = fit_topic_model(fit_texts)
+            t["items"] = len(fit_texts)
+        topic_fitted = True
+
+    def topics_for(labeled):
+        with timed("topics") as t:
+            t["items"] = len(labeled["texts"])
+            return assign_topics(topic_model, labeled["texts"])
+
+    def label_stage(batches):
+        nonlocal fetched_total
+        pending = []
+        for batch in batches:
+            fetched_total += len(batch)
+            print(f"🔍 Fetched {len(batch)} unlabeled posts ({fetched_total} total). Labeling...")
+            labeled = label_posts(batch, sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE)
+
+            if topic_fitted:
+                if topic_model is not None and labeled["texts"]:
+                    with timed("topics") as t:
+                        update_topic_model(topic_model, labeled["texts"])
+                        t["items"] = len(labeled["texts"])
+                yield labeled, topics_for(labeled)
+                continue
+            pending.append(labeled)
+            if sum(len(labeled["texts"]) for labeled in pending) < TOPIC_FIT_SIZE:
+                continue
+            fit_pending(pending)
+            for labeled in pending:
+                yield labeled, topics_for(labeled)
+            pending = []
+
+        if pending:
+            fit_pending(pending)
+            for labeled in pending:
+                yield labeled, topics_for(labeled)
+
+    def write_stage(labeled, topics):
+        nonlocal migrated_total
+        with timed("insert") as t:
+            t["items"] = migrate_labeled(labeled, topics)
+        migrated_total += t["items"]
+        last = labeled["posts"][-1]
+        save_state("ingest_cursor", {"created_at": last["created_at"], "uri": last["uri"]})
+        with timed("delete") as t:
+            delete_from_source(labeled["posts"])
+            t["items"] = len(labeled["posts"])
+        print(f"✅ Migrated {migrated_total}/{fetched_total} posts so far...", flush=True)
+
+    # Workers are forked before the pipeline threads exist.
+    start_label_pool([
+        ("sentiment", sent_tok, sent_model, sentiment_labels),
+        ("emotion", emot_tok, emot_model, emotion_labels),
+    ], DEVICE)
+    batches = fetch_unlabeled_batches(start_dt, end_dt, cursor)
+    try:
+        if PIPELINE_MODE:
+            print(f"🔀 Pipeline mode: overlapping fetch, labeling and inserts (queue size {PIPELINE_QUEUE_SIZE})...")
+            run_pipelined(batches, label_stage, write_stage)
+        else:
+            for labeled, topics in label_stage(batches):
+                write_stage(labeled, topics)
+    finally:
+        stop_label_pool()
+        posts_source.close()
+
+    # The backlog was fully drained, so the next run starts from the window edge again.
+    clear_state("ingest_cursor")
+
+    if not fetched_total:
+        print(f"⚠️ No new unlabeled posts found in {posts_source.name}.")
+        return
+    print(f"✅ Successfully migrated {migrated_total} of {fetched_total} fetched posts to Turso DB.")
+    report_label_timings()
+    if topic_model is not None and topic_model.components is not None:
+        save_topic_model(topic_model)
+        print(f"💾 Saved topic model ({topic_model.n_docs} documents seen).")
+        topic_words = topic_model.topic_words()
+    else:
+        topic_words = [["general"]] * TOPIC_COMPONENTS
 
     # --- Snapshot Generation ---
     print("📊 Generating all snapshot files...")
 
     if IS_TEST:
         print(f"🧪 Test mode: Analyzing (all posts).")
-        rows = conn.execute(
-            """
-            SELECT created_at, sentiment, emotion, topic, langs, text FROM posts
-            WHERE date(created_at) BETWEEN ? AND ?
-            """,
-            (start_date, end_date)
-        ).fetchall()
     else:
         print(f"📅 Analyzing posts from {start_date} to {end_date}...")
+    with timed("snapshot_aggregate") as t:
+        agg, t["items"] = build_window_aggregate(start_date, end_date)
+    compute_and_store_snapshot(agg, topic_words)
+
+# === Snapshot Aggregation ===
+SNAPSHOT_INCREMENTAL = os.getenv("SNAPSHOT_INCREMENTAL", "1") == "1"
+# Bump when the aggregation logic changes so cached day partials are recomputed.
+PARTIAL_VERSION = "2"
+PARTIAL_TYPES = ("activity", "hashtags", "emojis", "emoji_sentiment", "hashtag_graph", "topics")
+
+# Hashtag graph bounds. Only the first GRAPH_MAX_TAGS_PER_POST hashtags of a post form
+# pairs; GRAPH_HEAVY_HITTERS > 0 keeps the pair counter space-bounded. Pairs are read from
+# the tag tables in pages of GRAPH_PAIR_PAGE_SIZE, and every day's aggregate (and so its
+# cached partial) holds its own heavy-hitters summary, so with GRAPH_HEAVY_HITTERS set both
+# the per-day graphs and the merged one stay within 2 * capacity pairs. The stored graph
+# keeps edges of at least GRAPH_MIN_WEIGHT that rank in the GRAPH_TOP_K heaviest edges of
+# either endpoint, capped at GRAPH_MAX_EDGES overall. 0 disables a bound.
+GRAPH_MAX_TAGS_PER_POST = int(os.getenv("GRAPH_MAX_TAGS_PER_POST", "20"))
+GRAPH_HEAVY_HITTERS = int(os.getenv("GRAPH_HEAVY_HITTERS", "0"))
+GRAPH_MIN_WEIGHT = int(os.getenv("GRAPH_MIN_WEIGHT", "2"))
+GRAPH_TOP_K = int(os.getenv("GRAPH_TOP_K", "10"))
+GRAPH_MAX_EDGES = int(os.getenv("GRAPH_MAX_EDGES", "2000"))
+GRAPH_PAIR_PAGE_SIZE = int(os.getenv("GRAPH_PAIR_PAGE_SIZE", "50000"))
+
+class HeavyHitterCounter(Counter):
+    # Misra-Gries summary: once more than 2 * capacity keys are held, the (capacity + 1)-th
+    # largest count is subtracted from every key and the ones that drop to zero are evicted.
+    # Counts are underestimated by at most total / (capacity + 1), and summaries stay
+    # mergeable with update().
+    def __init__(self, capacity, *args):
+        self.capacity = capacity
+        super().__init__(*args)
+
+    def __reduce__(self):
+        return self.__class__, (self.capacity, dict(self))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if len(self) > 2 * self.capacity:
+            self._prune()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        if len(self) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        floor = sorted(self.values(), reverse=True)[self.capacity]
+        for key, n in list(self.items()):
+            if n <= floor:
+                del self[key]
+            else:
+                dict.__setitem__(self, key, n - floor)
+
+def new_hashtag_graph():
+    return HeavyHitterCounter(GRAPH_HEAVY_HITTERS) if GRAPH_HEAVY_HITTERS > 0 else Counter()
+
+def prune_hashtag_graph(graph):
+    # Heaviest edges first; the sort is stable, so ties keep first-seen order.
+    edges = sorted(((a, b, w) for (a, b), w in graph.items() if w >= GRAPH_MIN_WEIGHT), key=lambda e: -e[2])
+    if GRAPH_TOP_K > 0:
+        rank = Counter()
+        kept = []
+        for a, b, w in edges:
+            rank[a] += 1
+            rank[b] += 1
+            if rank[a] <= GRAPH_TOP_K or rank[b] <= GRAPH_TOP_K:
+                kept.append((a, b, w))
+        edges = kept
+    if GRAPH_MAX_EDGES > 0:
+        edges = edges[:GRAPH_MAX_EDGES]
+    return edges
+
+def _new_activity():
+    return {"volume": 0, "sentiment": Counter(), "emotion": Counter(), "language": Counter()}
+
+def _new_topic():
+    return {
+        "count": 0, "daily": defaultdict(int), "sentiment": Counter(), "emotion": Counter(),
+        "hashtags": Counter(), "emojis": Counter()
+    }
+
+class SnapshotAggregate:
+    # Mergeable counters behind every snapshot. Merging keeps first-seen key order, so
+    # merging partials in row order gives exactly what a single pass over the rows gives.
+    def __init__(self):
+        self.activity = defaultdict(_new_activity)
+        self.hashtags_daily = defaultdict(Counter)
+        self.emojis_daily = defaultdict(Counter)
+        self.emoji_sentiment = defaultdict(Counter)
+        self.hashtag_graph = new_hashtag_graph()
+        self.topic_summary = defaultdict(_new_topic)
+
+    def add_rows(self, rows):
+        # rows: (day, sentiment, emotion, topic, langs_json); hashtags and emojis come from add_tags.
+        activity = self.activity
+        topic_summary = self.topic_summary
+
+        for date, sentiment, emotion, topic, langs_json in rows:
+            langs = json.loads(langs_json or "[]")
+
+            activity[date]["volume"] += 1
+            activity[date]["sentiment"][sentiment] += 1
+            activity[date]["emotion"][emotion] += 1
+            for l in langs:
+                activity[date]["language"][l] += 1
+
+            topic_summary[topic]["count"] += 1
+            topic_summary[topic]["daily"][date] += 1
+            topic_summary[topic]["sentiment"][sentiment] += 1
+            topic_summary[topic]["emotion"][emotion] += 1
+        return self
+
+    def add_tags(self, day):
+        # Tag counts for one day straight from the tag tables. Each query is ordered by the
+        # first tag row of its group, which is the order a pass over the post texts would
+        # first see each key in.
+        for tag, n in conn.execute(
+            "SELECT tag, COUNT(*) FROM post_hashtags WHERE day = ? GROUP BY tag ORDER BY MIN(rowid)", (day,)
+        ).fetchall():
+            self.hashtags_daily[day][tag] += n
+        for emoji, n in conn.execute(
+            "SELECT emoji, COUNT(*) FROM post_emojis WHERE day = ? GROUP BY emoji ORDER BY MIN(rowid)", (day,)
+        ).fetchall():
+            self.emojis_daily[day][emoji] += n
+        for sentiment, emoji, n in conn.execute(
+            """
+            SELECT p.sentiment, e.emoji, COUNT(*) FROM post_emojis e JOIN posts p ON p.uri = e.post_uri
+            WHERE e.day = ? GROUP BY p.sentiment, e.emoji ORDER BY MIN(e.rowid)
+            """, (day,)
+        ).fetchall():
+            self.emoji_sentiment[sentiment][emoji] += n
+        for topic, tag, n in conn.execute(
+            """
+            SELECT p.topic, h.tag, COUNT(*) FROM post_hashtags h JOIN posts p ON p.uri = h.post_uri
+            WHERE h.day = ? GROUP BY p.topic, h.tag ORDER BY MIN(h.rowid)
+            """, (day,)
+        ).fetchall():
+            self.topic_summary[topic]["hashtags"][tag] += n
+        for topic, emoji, n in conn.execute(
+            """
+            SELECT p.topic, e.emoji, COUNT(*) FROM post_emojis e JOIN posts p ON p.uri = e.post_uri
+            WHERE e.day = ? GROUP BY p.topic, e.emoji ORDER BY MIN(e.rowid)
+            """, (day,)
+        ).fetchall():
+            self.topic_summary[topic]["emojis"][emoji] += n
+
+        # Hashtag co-occurrence: every ordered pair among a post's first GRAPH_MAX_TAGS_PER_POST
+        # tags, so hashtag-spam posts cannot blow up quadratically. Packing both rowids into
+        # one integer orders pairs by (first tag, second tag) position; that key is unique per
+        # pair, so the distinct pairs are paged by it and never all held at once before they
+        # reach the (possibly heavy-hitters) counter.
+        max_pos = GRAPH_MAX_TAGS_PER_POST if GRAPH_MAX_TAGS_PER_POST > 0 else -1
+        last_key = -1
+        while True:
+            rows = conn.execute(
+                """
+                SELECT MIN(a.tag, b.tag), MAX(a.tag, b.tag), COUNT(*), MIN(a.rowid * 4294967296 + b.rowid) AS first_key
+                FROM post_hashtags a JOIN post_hashtags b ON b.post_uri = a.post_uri AND b.pos > a.pos
+                WHERE a.day = ? AND (? < 0 OR b.pos < ?)
+                GROUP BY 1, 2 HAVING first_key > ? ORDER BY first_key LIMIT ?
+                """, (day, max_pos, max_pos, last_key, GRAPH_PAIR_PAGE_SIZE)
+            ).fetchall()
+            for a, b, n, _ in rows:
+                self.hashtag_graph[(a, b)] += n
+            if len(rows) < GRAPH_PAIR_PAGE_SIZE:
+                return self
+            last_key = rows[-1][3]
+
+    def merge(self, other):
+        for day, a in other.activity.items():
+            mine = self.activity[day]
+            mine["volume"] += a["volume"]
+            for k in ("sentiment", "emotion", "language"):
+                mine[k].update(a[k])
+        for day, counts in other.hashtags_daily.items():
+            self.hashtags_daily[day].update(counts)
+        for day, counts in other.emojis_daily.items():
+            self.emojis_daily[day].update(counts)
+        for sentiment, counts in other.emoji_sentiment.items():
+            self.emoji_sentiment[sentiment].update(counts)
+        self.hashtag_graph.update(other.hashtag_graph)
+        for topic, t in other.topic_summary.items():
+            mine = self.topic_summary[topic]
+            mine["count"] += t["count"]
+            for day, n in t["daily"].items():
+                mine["daily"][day] += n
+            for k in ("sentiment", "emotion", "hashtags", "emojis"):
+                mine[k].update(t[k])
+        return self
+
+    def to_json(self):
+        return {
+            "activity": self.activity,
+            "hashtags": self.hashtags_daily,
+            "emojis": self.emojis_daily,
+            "emoji_sentiment": self.emoji_sentiment,
+            "hashtag_graph": [[a, b, w] for (a, b), w in self.hashtag_graph.items()],
+            "topics": self.topic_summary,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        agg = cls()
+        for day, a in data["activity"].items():
+            agg.activity[day] = {
+                "volume": a["volume"], "sentiment": Counter(a["sentiment"]),
+                "emotion": Counter(a["emotion"]), "language": Counter(a["language"])
+            }
+        agg.hashtags_daily.update((k, Counter(v)) for k, v in data["hashtags"].items())
+        agg.emojis_daily.update((k, Counter(v)) for k, v in data["emojis"].items())
+        agg.emoji_sentiment.update((k, Counter(v)) for k, v in data["emoji_sentiment"].items())
+        agg.hashtag_graph.update({(a, b): w for a, b, w in data["hashtag_graph"]})
+        for topic, t in data["topics"].items():
+            agg.topic_summary[topic] = {
+                "count": t["count"], "daily": defaultdict(int, t["daily"]),
+                "sentiment": Counter(t["sentiment"]), "emotion": Counter(t["emotion"]),
+                "hashtags": Counter(t["hashtags"]), "emojis": Counter(t["emojis"])
+            }
+        return agg
+
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", "5000"))
+
+def iter_window_rows(start, end):
+    # Keyset pages over the (day, rowid) order of idx_posts_day, so at most
+    # SNAPSHOT_CHUNK_SIZE rows are held at once whatever the driver buffers per query.
+    last_day, last_rowid = "", 0
+    while True:
         rows = conn.execute(
             """
-            SELECT created_at, sentiment, emotion, topic, langs, text FROM posts
-            WHERE date(created_at) BETWEEN ? AND ?
+            SELECT rowid, day, sentiment, emotion, topic, langs FROM posts
+            WHERE day BETWEEN ? AND ? AND (day > ? OR (day = ? AND rowid > ?))
+            ORDER BY day, rowid
+            LIMIT ?
             """,
-            (start_date, end_date)
+            (start, end, last_day, last_day, last_rowid, SNAPSHOT_CHUNK_SIZE)
         ).fetchall()
-    compute_and_store_snapshot(rows, topic_words)
+        for row in rows:
+            yield row[1:]
+        if len(rows) < SNAPSHOT_CHUNK_SIZE:
+            return
+        last_day, last_rowid = rows[-1][1], rows[-1][0]
+        del rows
+
+def peak_rss_mb():
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# --- Columnar backend ---
+# SNAPSHOT_BACKEND=numpy factorizes each chunk into integer codes (first-seen order) and
+# counts every day/topic x sentiment/emotion/language table with np.unique/bincount.
+# Pairs are emitted in the order of their first row, so the result is identical to
+# SnapshotAggregate.add_rows.
+SNAPSHOT_BACKEND = os.getenv("SNAPSHOT_BACKEND", "python")
+
+def _factorize(values):
+    import numpy as np
+
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64, count=len(values))
+    return codes, list(index)
+
+def _grouped_counts(groups, keys, n_keys):
+    import numpy as np
+
+    pairs, first, counts = np.unique(groups * n_keys + keys, return_index=True, return_counts=True)
+    order = np.argsort(first, kind="stable")
+    return zip((pairs[order] // n_keys).tolist(), (pairs[order] % n_keys).tolist(), counts[order].tolist())
+
+def aggregate_columnar(rows):
+    import numpy as np
+
+    rows = rows if isinstance(rows, list) else list(rows)
+    agg = SnapshotAggregate()
+    if not rows:
+        return agg
+
+    day_c, days = _factorize([r[0] for r in rows])
+    sent_c, sents = _factorize([r[1] for r in rows])
+    emot_c, emots = _factorize([r[2] for r in rows])
+    topic_c, topics = _factorize([r[3] for r in rows])
+    langs_c, langs_values = _factorize([r[4] for r in rows])
+
+    # Activity: day x sentiment / emotion, and languages expanded from each distinct langs value.
+    for d, volume in enumerate(np.bincount(day_c, minlength=len(days)).tolist()):
+        agg.activity[days[d]]["volume"] = volume
+    for d, s, n in _grouped_counts(day_c, sent_c, len(sents)):
+        agg.activity[days[d]]["sentiment"][sents[s]] = n
+    for d, e, n in _grouped_counts(day_c, emot_c, len(emots)):
+        agg.activity[days[d]]["emotion"][emots[e]] = n
+    parsed_langs = [json.loads(v or "[]") for v in langs_values]
+    for d, l, n in _grouped_counts(day_c, langs_c, len(langs_values)):
+        language = agg.activity[days[d]]["language"]
+        for lang in parsed_langs[l]:
+            language[lang] += n
+
+    # Topics: topic x day / sentiment / emotion.
+    for t, count in enumerate(np.bincount(topic_c, minlength=len(topics)).tolist()):
+        agg.topic_summary[topics[t]]["count"] = count
+    for t, d, n in _grouped_counts(topic_c, day_c, len(days)):
+        agg.topic_summary[topics[t]]["daily"][days[d]] = n
+    for t, s, n in _grouped_counts(topic_c, sent_c, len(sents)):
+        agg.topic_summary[topics[t]]["sentiment"][sents[s]] = n
+    for t, e, n in _grouped_counts(topic_c, emot_c, len(emots)):
+        agg.topic_summary[topics[t]]["emotion"][emots[e]] = n
+    return agg
+
+def _aggregate_chunk(rows):
+    if SNAPSHOT_BACKEND == "numpy":
+        return aggregate_columnar(rows)
+    return SnapshotAggregate().add_rows(rows)
+
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "0"))
+
+def _init_snapshot_worker():
+    # The parent's connection must not be used across fork; each worker reads through its own.
+    global conn
+    conn = open_db()
+
+def aggregate_day(day):
+    # Everything for one day: post rows plus hashtag, emoji, emoji-sentiment and graph counts.
+    return aggregate_rows(iter_window_rows(day, day)).add_tags(day)
+
+@contextmanager
+def snapshot_pool():
+    # Workers aggregate whole days (aggregate_day) against their own connections.
+    if SNAPSHOT_WORKERS <= 1:
+        yield None
+        return
+    import multiprocessing
 
-def compute_and_store_snapshot(rows, topic_words=None):
+    pool = multiprocessing.get_context("fork").Pool(SNAPSHOT_WORKERS, initializer=_init_snapshot_worker)
+    print(f"🧵 Aggregating snapshots with {SNAPSHOT_WORKERS} workers.")
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
+
+def aggregate_rows(rows):
+    if SNAPSHOT_BACKEND != "numpy":
+        return SnapshotAggregate().add_rows(rows)
+
+    # Chunks are merged in row order, which keeps the output identical to a single pass.
+    agg = SnapshotAggregate()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, SNAPSHOT_CHUNK_SIZE))
+        if not chunk:
+            return agg
+        agg.merge(_aggregate_chunk(chunk))
+
+def aggregate_days(days, pool):
+    # Day aggregates in day order, computed by the pool when there is one.
+    if pool is None:
+        return map(aggregate_day, days)
+    return pool.imap(aggregate_day, days)
+
+def build_window_aggregate(start, end):
+    ensure_tags()
+    with snapshot_pool() as pool:
+        if not SNAPSHOT_INCREMENTAL:
+            days = [row[0] for row in conn.execute(
+                "SELECT DISTINCT day FROM posts WHERE day BETWEEN ? AND ? ORDER BY day", (start, end)
+            ).fetchall()]
+            # Merging whole days in day order gives the same first-seen order as one pass.
+            agg = SnapshotAggregate()
+            for part in aggregate_days(days, pool):
+                agg.merge(part)
+            total = sum(a["volume"] for a in agg.activity.values())
+            print(f"🔍 Found {total} posts in the specified date range.")
+            print(f"📈 Peak RSS after aggregation: {peak_rss_mb():.1f} MB")
+            return agg, total
+
+        # A day's partial is reused while its post count and newest rowid are unchanged;
+        # late-arriving posts for an older day change both and invalidate just that day.
+        versions = {
+            day: f"{PARTIAL_VERSION}:{GRAPH_MAX_TAGS_PER_POST}:{GRAPH_HEAVY_HITTERS}:{count}:{max_rowid}"
+            for day, count, max_rowid in conn.execute(
+                "SELECT day, COUNT(*), MAX(rowid) FROM posts WHERE day BETWEEN ? AND ? GROUP BY day", (start, end)
+            ).fetchall()
+        }
+        cached = defaultdict(dict)
+        stored_versions = {}
+        for day, type_, version, data in conn.execute(
+            "SELECT day, type, version, data FROM daily_partials WHERE day BETWEEN ? AND ?", (start, end)
+        ).fetchall():
+            if version == versions.get(day):
+                cached[day][type_] = json.loads(data)
+                stored_versions[day] = version
+
+        reusable = {day for day in versions if day in stored_versions and set(cached[day]) == set(PARTIAL_TYPES)}
+        # Missing days are all aggregated (in parallel with a pool) before any partial is
+        # written, so workers never read while this connection holds a write lock.
+        missing = [day for day in sorted(versions) if day not in reusable]
+        computed = dict(zip(missing, aggregate_days(missing, pool)))
+
+        agg = SnapshotAggregate()
+        total = 0
+        reused = []
+        for day in sorted(versions):
+            if day in reusable:
+                part = SnapshotAggregate.from_json(cached[day])
+                reused.append(day)
+            else:
+                part = computed.pop(day)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO daily_partials VALUES (?, ?, ?, ?)",
+                    [(day, type_, versions[day], json.dumps(data)) for type_, data in part.to_json().items()]
+                )
+                print(f"🧮 Aggregated {sum(a['volume'] for a in part.activity.values())} posts for {day}.")
+            total += sum(a["volume"] for a in part.activity.values())
+            agg.merge(part)
+
+        conn.execute("DELETE FROM daily_partials WHERE day < ?", (start,))
+        conn.commit()
+        safe_sync()
+        print(f"🔍 Found {total} posts in the specified date range ({len(reused)} of {len(versions)} days from cached partials).")
+        print(f"📈 Peak RSS after aggregation: {peak_rss_mb():.1f} MB")
+        return agg, total
+
+def compute_and_store_snapshot(agg, topic_words=None):
+    started = time.perf_counter()
     if topic_words is None:
         topic_words = [["general"]] * 8  # Default topics if not provided
-    # === Initialize counters ===
-    activity = defaultdict(lambda: {"volume": 0, "sentiment": Counter(), "emotion": Counter(), "language": Counter()})
-    hashtags_daily = defaultdict(Counter)
-    emojis_daily = defaultdict(Counter)
-    emoji_sentiment = defaultdict(Counter)
-    hashtag_graph = Counter()
-    topic_summary = defaultdict(lambda: {
-        "count": 0, "daily": defaultdict(int), "sentiment": Counter(), "emotion": Counter(),
-        "hashtags": Counter(), "emojis": Counter()
-    })
-
-    emoji_re = re.compile(r"["
-        u"\U0001F600-\U0001F64F"
-        u"\U0001F300-\U0001F5FF"
-        u"\U0001F680-\U0001F6FF"
-        u"\u2600-\u26FF"
-        u"\U0001F1E0-\U0001F1FF"
-        "]", flags=re.UNICODE)
-    hashtag_re = re.compile(r"#\w+")
-
-    for created_at, sentiment, emotion, topic, langs_json, text in rows:
-        date = isoparse(created_at).date().isoformat()
-        langs = json.loads(langs_json or "[]")
-        hashtags = hashtag_re.findall(text)
-        emojis = emoji_re.findall(text)
-
-        activity[date]["volume"] += 1
-        activity[date]["sentiment"][sentiment] += 1
-        activity[date]["emotion"][emotion] += 1
-        for l in langs:
-            activity[date]["language"][l] += 1
-
-        for h in hashtags:
-            hashtags_daily[date][h] += 1
-        for e in emojis:
-            emojis_daily[date][e] += 1
-            emoji_sentiment[sentiment][e] += 1
-
-        topic_summary[topic]["count"] += 1
-        topic_summary[topic]["daily"][date] += 1
-        topic_summary[topic]["sentiment"][sentiment] += 1
-        topic_summary[topic]["emotion"][emotion] += 1
-        topic_summary[topic]["hashtags"].update(hashtags)
-        topic_summary[topic]["emojis"].update(emojis)
-
-        # Hashtag co-occurrence
-        for i in range(len(hashtags)):
-            for j in range(i + 1, len(hashtags)):
-                key = tuple(sorted([hashtags[i], hashtags[j]]))
-                hashtag_graph[key] += 1
+    activity = agg.activity
+    hashtags_daily = agg.hashtags_daily
+    emojis_daily = agg.emojis_daily
+    emoji_sentiment = agg.emoji_sentiment
+    hashtag_graph = agg.hashtag_graph
+    topic_summary = agg.topic_summary
 
     # === META STATS ===
-    all_posts = conn.execute("SELECT sentiment, emotion, topic, langs, text FROM posts").fetchall()
-    all_sent = set()
-    all_emot = set()
-    all_topics = set()
-    all_langs = set()
-    all_tags = Counter()
-    all_emjs = Counter()
-
-    for sent, emot, topic, langs_json, text in all_posts:
-        all_sent.add(sent)
-        all_emot.add(emot)
-        all_topics.add(topic)
-        all_langs.update(json.loads(langs_json or "[]"))
-        all_tags.update(hashtag_re.findall(text))
-        all_emjs.update(emoji_re.findall(text))
+    complete, top_hashtag, top_emoji = rollup_totals()
 
     last_7 = list(activity.values())
     # Add checks to handle empty data in last_7
@@ -432,17 +2223,10 @@ def compute_and_store_snapshot(rows, topic_words=None):
         return
 
     # Update top calculations to handle empty lists
-    store_snapshot("meta", "meta", {
+    snapshots = {}
+    snapshots["meta"] = {
         "date": today,
-        "complete": {
-            "total_posts": len(all_posts),
-            "total_sentiments": len(all_sent),
-            "total_emotions": len(all_emot),
-            "total_languages": len(all_langs),
-            "total_topics": len(all_topics),
-            "total_hashtags": len(all_tags),
-            "total_emojis": len(all_emjs),
-        },
+        "complete": complete,
         "last_week": {
             "total_posts": sum(x["volume"] for x in last_7),
             "total_sentiments": len(set(k for x in last_7 for k in x["sentiment"])),
@@ -461,26 +2245,26 @@ def compute_and_store_snapshot(rows, topic_words=None):
             "sentiment": Counter(k for x in last_7 for k in x["sentiment"].elements()).most_common(1)[0][0] if last_7 and Counter(k for x in last_7 for k in x["sentiment"].elements()).most_common(1) else None,
             "emotion": Counter(k for x in last_7 for k in x["emotion"].elements()).most_common(1)[0][0] if last_7 and Counter(k for x in last_7 for k in x["emotion"].elements()).most_common(1) else None,
             "language": Counter(k for x in last_7 for k in x["language"].elements()).most_common(1)[0][0] if last_7 and Counter(k for x in last_7 for k in x["language"].elements()).most_common(1) else None,
-            "hashtag": all_tags.most_common(1)[0][0] if all_tags.most_common(1) else None,
-            "emoji": all_emjs.most_common(1)[0][0] if all_emjs.most_common(1) else None
+            "hashtag": top_hashtag,
+            "emoji": top_emoji
         }
-    })
+    }
 
-    store_snapshot("activity", "activity", dict(activity))
-    store_snapshot("hashtags", "hashtags", {k: dict(v) for k, v in hashtags_daily.items()})
-    store_snapshot("emojis", "emojis", {k: dict(v) for k, v in emojis_daily.items()})
+    snapshots["activity"] = dict(activity)
+    snapshots["hashtags"] = {k: dict(v) for k, v in hashtags_daily.items()}
+    snapshots["emojis"] = {k: dict(v) for k, v in emojis_daily.items()}
 
-    store_snapshot("emoji_sentiment", "emoji_sentiment", {k: dict(v) for k, v in emoji_sentiment.items()})
-    store_snapshot("hashtag_graph", "hashtag_graph", [
-        {"source": a, "target": b, "weight": w} for (a, b), w in hashtag_graph.items()
-    ])
-    store_snapshot("sentiment_by_topic", "sentiment_by_topic", {
+    snapshots["emoji_sentiment"] = {k: dict(v) for k, v in emoji_sentiment.items()}
+    snapshots["hashtag_graph"] = [
+        {"source": a, "target": b, "weight": w} for a, b, w in prune_hashtag_graph(hashtag_graph)
+    ]
+    snapshots["sentiment_by_topic"] = {
         k: dict(v["sentiment"]) for k, v in topic_summary.items()
-    })
-    store_snapshot("emotion_by_topic", "emotion_by_topic", {
+    }
+    snapshots["emotion_by_topic"] = {
         k: dict(v["emotion"]) for k, v in topic_summary.items()
-    })
-    store_snapshot("topics", "topics", {
+    }
+    snapshots["topics"] = {
         k: {
             "label": topic_words[int(k.split("_")[1])] if "topic_" in k else ["general"],
             "count": v["count"],
@@ -491,9 +2275,80 @@ def compute_and_store_snapshot(rows, topic_words=None):
             "emojis": [e for e, _ in v["emojis"].most_common(10)],
         }
         for k, v in topic_summary.items()
-    })
+    }
+    record_stage("snapshot_compute", time.perf_counter() - started, len(snapshots))
+    with timed("snapshot_store") as t:
+        t["items"] = len(snapshots)
+        store_snapshots(snapshots)
 
 # === Export-only mode ===
+# EXPORT_COMPACT=1 drops indentation, EXPORT_COMPRESS=gz,br writes precompressed siblings
+# next to every file, and EXPORT_SHARDS=1 additionally splits the date-keyed snapshots into
+# summary/<type>/<day>.json with an index.json manifest.
+EXPORT_COMPACT = os.getenv("EXPORT_COMPACT", "0") == "1"
+EXPORT_COMPRESS = [c.strip() for c in os.getenv("EXPORT_COMPRESS", "").split(",") if c.strip()]
+EXPORT_SHARDS = os.getenv("EXPORT_SHARDS", "0") == "1"
+SHARDED_TYPES = ("activity", "hashtags", "emojis")
+COMPRESS_FORMATS = ("gz", "br")
+_skipped_formats = set()
+
+def encode_export(content):
+    if EXPORT_COMPACT:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(content, indent=2, ensure_ascii=False).encode("utf-8")
+
+def compress_export(data, fmt):
+    if fmt == "gz":
+        import gzip
+
+        # mtime=0 keeps the archive byte-identical for identical content.
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if fmt == "br":
+        try:
+            import brotli
+        except ImportError:
+            return None
+        return brotli.compress(data, quality=11)
+    return None
+
+def write_export(path, content):
+    data = encode_export(content)
+    outputs = {path: data}
+    for fmt in EXPORT_COMPRESS:
+        compressed = compress_export(data, fmt)
+        if compressed is None:
+            if fmt not in _skipped_formats:
+                _skipped_formats.add(fmt)
+                print(f"⚠️ Skipping .{fmt} outputs (unsupported format or missing module).")
+            continue
+        outputs[f"{path}.{fmt}"] = compressed
+    for out_path, out_data in outputs.items():
+        with open(out_path, "wb") as f:
+            f.write(out_data)
+    # Compressed siblings from an earlier export with other settings would go stale.
+    for fmt in COMPRESS_FORMATS:
+        if f"{path}.{fmt}" not in outputs and os.path.exists(f"{path}.{fmt}"):
+            os.remove(f"{path}.{fmt}")
+    return outputs
+
+def write_shards(type_, content):
+    # One file per day plus a manifest; shards for days that left the window are removed.
+    shard_dir = os.path.join("summary", type_)
+    os.makedirs(shard_dir, exist_ok=True)
+    days = []
+    written = set()
+    for day in sorted(content):
+        path = os.path.join(shard_dir, f"{day}.json")
+        outputs = write_export(path, content[day])
+        written.update(outputs)
+        days.append({"date": day, "path": f"{type_}/{day}.json", "bytes": len(outputs[path])})
+    written.update(write_export(os.path.join(shard_dir, "index.json"), {"type": type_, "days": days}))
+
+    for name in os.listdir(shard_dir):
+        if os.path.join(shard_dir, name) not in written:
+            os.remove(os.path.join(shard_dir, name))
+    return written
+
 def export_snapshots_to_json():
     import os
     import json
@@ -521,15 +2376,36 @@ def export_snapshots_to_json():
         return
     latest_date = latest_date_row[0]
 
-    # Fetch all rows for the latest date
-    rows = conn.execute(
-        "SELECT type, scope, data FROM summary_snapshots WHERE date = ?", (latest_date,)
+    # The manifest remembers, per type, the stored hash it was last exported from and the files
+    # that export wrote (plus the export settings used). Only hashes are read up front; data is
+    # fetched just for types whose hash changed or whose files went missing.
+    manifest_path = "summary/.export_manifest.json"
+    settings = {"compact": EXPORT_COMPACT, "compress": EXPORT_COMPRESS, "shards": EXPORT_SHARDS}
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    exported = manifest.get("files", {}) if manifest.get("settings") == settings else {}
+    files = {}
+
+    hashes = conn.execute(
+        "SELECT type, hash FROM summary_snapshots WHERE date = ?", (latest_date,)
     ).fetchall()
-
-    data_map = {}
-
-    for type_, scope, data_json in rows:
-        parsed = json.loads(data_json)
+    written = skipped = 0
+    for type_, hash_val in hashes:
+        previous = exported.get(type_)
+        if (
+            isinstance(previous, dict) and previous.get("hash") == hash_val
+            and previous.get("outputs") and all(os.path.exists(path) for path in previous["outputs"])
+        ):
+            files[type_] = previous
+            skipped += 1
+            continue
+        row = conn.execute(
+            "SELECT data FROM summary_snapshots WHERE date = ? AND type = ?", (latest_date, type_)
+        ).fetchone()
+        parsed = json.loads(row[0])
 
         # Only remap sentiment labels without changing structure
         if type_ == "meta":
@@ -555,15 +2431,22 @@ def export_snapshots_to_json():
             for topic, info in parsed.items():
                 if "sentiment" in info:
                     info["sentiment"] = remap_sentiments(info["sentiment"])
-            data_map["topics"] = parsed
-
-        data_map[type_] = parsed
-
-    # Dump to JSON files
-    for fkey, content in data_map.items():
-        with open(f"summary/{fkey}.json", "w", encoding="utf-8") as f:
-            json.dump(content, f, indent=2, ensure_ascii=False)
 
+        # Dump to JSON files
+        outputs = set(write_export(f"summary/{type_}.json", parsed))
+        if EXPORT_SHARDS and type_ in SHARDED_TYPES and isinstance(parsed, dict):
+            outputs.update(write_shards(type_, parsed))
+        elif os.path.isdir(f"summary/{type_}"):
+            # Shards left over from an export with EXPORT_SHARDS=1.
+            shutil.rmtree(f"summary/{type_}")
+        files[type_] = {"hash": hash_val, "outputs": sorted(outputs)}
+        written += 1
+
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "files": files}, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    print(f"📝 Wrote {written} snapshot files, skipped {skipped} unchanged.")
     print(f"✅ Exported snapshot for {latest_date} into `summary/` folder.")
 
 
@@ -574,51 +2457,60 @@ def generate_snapshots_from_turso():
     end_date = (date.today() - timedelta(days=1)).isoformat()  # yesterday
     start_date = (date.today() - timedelta(days=7)).isoformat()  # 7 days before yesterday
 
-    if IS_TEST:
-        print(f"📅 Analyzing posts from {start_date} to {end_date}...")
-
-        rows = conn.execute(
-            """
-            SELECT created_at, sentiment, emotion, topic, langs, text FROM posts
-            WHERE date(created_at) BETWEEN ? AND ?
-            """,
-            (start_date, end_date)
-        ).fetchall()
-    else:
-        print(f"📅 Analyzing posts from {start_date} to {end_date}...")
-
-        rows = conn.execute(
-            """
-            SELECT created_at, sentiment, emotion, topic, langs, text FROM posts
-            WHERE date(created_at) BETWEEN ? AND ?
-            """,
-            (start_date, end_date)
-        ).fetchall()
-    
-    print(f"🔍 Found {len(rows)} posts in the specified date range.")
+    print(f"📅 Analyzing posts from {start_date} to {end_date}...")
+    with timed("snapshot_aggregate") as t:
+        agg, total = build_window_aggregate(start_date, end_date)
+        t["items"] = total
 
-    if not rows:
+    if not total:
         print("⚠️ No posts found in the specified date range.")
         return
-    compute_and_store_snapshot(rows)
+    # Topic labels come from the stored topic model, whose topic IDs the posts were labeled with.
+    topic_model = load_topic_model()
+    compute_and_store_snapshot(agg, topic_model.topic_words() if topic_model else None)
 
 # === Entrypoint ===
-if __name__ == "__main__":
+def run_export():
+    connect_db()
+    print("🗂️ Exporting snapshots to JSON files...")
+    with timed("export"):
+        export_snapshots_to_json()
+    print("✅ Only exported snapshots.")
+
+def run_snapshots():
+    connect_db()
+    print("🧪 Skipping labeling and generating snapshots from Turso DB...")
+    generate_snapshots_from_turso()
+    print("✅ Generated snapshots from Turso.")
+
+def run_labeling():
+    connect_source()
+    connect_db()
+    print("🔍 Fetching and labeling posts, then generating snapshots...")
+    sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE = load_models()
+    hardened_label_and_migrate(sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE)
+
+def main():
+    print("✅ summary.py is running...")
+    started_at = datetime.utcnow().isoformat() + "Z"
+    started = time.perf_counter()
     os.makedirs("summary", exist_ok=True)
 
     print("🔄 Starting summary.py...")
 
     if os.getenv("EXPORT_ONLY") == "1":
-        print("🗂️ Exporting snapshots to JSON files...")
-        export_snapshots_to_json()
-        print("✅ Only exported snapshots.")
+        mode = "export"
+        run_export()
     elif os.getenv("SKIP_LABELING") == "1":
-        print("🧪 Skipping labeling and generating snapshots from Turso DB...")
-        generate_snapshots_from_turso()
-        print("✅ Generated snapshots from Turso.")
+        mode = "snapshots"
+        run_snapshots()
     else:
-        print("🔍 Fetching and labeling posts, then generating snapshots...")
-        sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE = load_models()
-        hardened_label_and_migrate(sent_tok, sent_model, sentiment_labels, emot_tok, emot_model, emotion_labels, DEVICE)
+        mode = "labeling"
+        run_labeling()
     conn.commit()
-    safe_sync()
\ No newline at end of file
+    safe_sync()
+    print(f"📈 Peak RSS for this run: {peak_rss_mb():.1f} MB")
+    write_run_report(run_report(mode, started_at, time.perf_counter() - started))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file